@@ -1,17 +1,56 @@
 # bot/bot.py
-import os, asyncio
+import os, asyncio, time, functools, threading
+from collections import OrderedDict
+from typing import Dict
 from dotenv import load_dotenv
 from telegram import Update, KeyboardButton, ReplyKeyboardMarkup, WebAppInfo
-from telegram.ext import ApplicationBuilder, CommandHandler, MessageHandler, ContextTypes, filters
-
-from storage import storage
-from server.telegram_api import send_teacher_snapshot
+from telegram.ext import Application, ApplicationBuilder, CommandHandler, MessageHandler, ContextTypes, filters
 
+# Before importing storage, which reads its settings (e.g. the backend) at import time.
 load_dotenv()
+# Handlers await storage through the async facade so a slow save doesn't hold up other updates.
+from storage import aio
+
 TOKEN = os.environ.get("NOETICA_BOT_TOKEN") or ""
 WEBAPP_URL = os.environ.get("WEBAPP_URL") or ""
 if not TOKEN:
     raise SystemExit("NOETICA_BOT_TOKEN not set")
+# When set, Telegram pushes updates to the API server (server/bot_webhook.py) instead of polling.
+WEBHOOK_URL = os.environ.get("NOETICA_WEBHOOK_URL") or ""
+CONCURRENT_UPDATES = int(os.environ.get("NOETICA_BOT_CONCURRENCY") or 32)
+
+# (chat_id, message_id) -> (assignment_id or None, expiry) for replies to the bot's posts.
+# Misses expire so a post whose message id is stored just after a student replies is found.
+ASSIGNMENT_CACHE_SIZE = 10000
+MISS_TTL_SECONDS = 10
+_assignment_posts: "OrderedDict[tuple, tuple]" = OrderedDict()
+
+# Updates are handled concurrently, but those from one sender in one chat run in arrival
+# order: (chat_id, user_id) -> [lock, handlers holding or waiting for it].
+_sender_locks: Dict[tuple, list] = {}
+
+def in_order(handler):
+    """
+    Serialise a handler per (chat, sender); asyncio.Lock wakes waiters first come, first served.
+
+    The guarantee is per sender within a chat, not per chat: updates from different
+    students in one group may interleave. Their handlers touch independent records (each
+    student's own submission), and a per-chat lock would serialise a deadline rush in a
+    class group again.
+    """
+    @functools.wraps(handler)
+    async def wrapped(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        key = (update.effective_chat and update.effective_chat.id, update.effective_user and update.effective_user.id)
+        entry = _sender_locks.setdefault(key, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                return await handler(update, context)
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del _sender_locks[key]
+    return wrapped
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     who = update.effective_user.full_name
@@ -33,50 +72,79 @@ async def init_class(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     teacher_id = update.effective_user.id
     title = update.effective_chat.title or f"Class {update.effective_chat.id}"
-    storage.ensure_teacher(teacher_id, update.effective_user.full_name)
-    cls = storage.link_class(update.effective_chat.id, title, teacher_id)
+    await aio.storage.ensure_teacher(teacher_id, update.effective_user.full_name)
+    cls = await aio.storage.link_class(update.effective_chat.id, title, teacher_id)
     await update.message.reply_text(f"✅ Class linked: {title}\nUse /dashboard (Mini App) to create assignments.")
-    send_teacher_snapshot(teacher_id)
+    await aio.outbox.request_snapshot(teacher_id)
+
+async def _assignment_for_post(chat_id: int, message_id: int):
+    """Assignment id posted as `message_id` in the chat, cached; None for other messages."""
+    key = (chat_id, message_id)
+    hit = _assignment_posts.get(key)
+    if hit and hit[1] > time.monotonic():
+        _assignment_posts.move_to_end(key)
+        return hit[0]
+    a = await aio.storage.find_assignment_by_message(str(chat_id), message_id)
+    aid = a["assignment_id"] if a else None
+    _assignment_posts[key] = (aid, float("inf") if aid else time.monotonic() + MISS_TTL_SECONDS)
+    if len(_assignment_posts) > ASSIGNMENT_CACHE_SIZE:
+        _assignment_posts.popitem(last=False)
+    return aid
 
 async def reply_capture(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Only group replies reach here (see the handler's filters); assignments are posted by
+    # this bot, so replies to anyone else's message are ordinary chatter.
     msg = update.message
     if not msg or not msg.reply_to_message: return
-    if update.effective_chat.type not in ("group","supergroup"): return
-    replied_id = msg.reply_to_message.message_id
+    replied = msg.reply_to_message
+    if not replied.from_user or replied.from_user.id != context.bot.id: return
     group_id = str(update.effective_chat.id)
-    # find assignment by posted message id
-    found = None
-    for a in storage.list_assignments(group_id):
-        if a.get("posted_message_id") == replied_id:
-            found = a; break
-    if not found: return
+    assignment_id = await _assignment_for_post(update.effective_chat.id, replied.message_id)
+    if not assignment_id: return
     # collect file info
     file_meta = None
     if msg.document:
         file = msg.document
-        file_meta = {"file_id": file.file_id, "mime": file.mime_type, "size": file.file_size, "local_path": ""}
+        file_meta = {"file_id": file.file_id, "filename": file.file_name, "mime": file.mime_type, "size": file.file_size, "local_path": ""}
     elif msg.photo:
         p = msg.photo[-1]
         file_meta = {"file_id": p.file_id, "mime":"image/jpeg", "size": p.file_size, "local_path": ""}
     elif msg.video:
         v = msg.video
         file_meta = {"file_id": v.file_id, "mime": v.mime_type, "size": v.file_size, "local_path": ""}
-    sub = storage.add_submission(found["assignment_id"], msg.from_user.id, msg.from_user.full_name, text=(msg.text or ""), file_meta=file_meta, message_id=msg.message_id)
+    sub = await aio.storage.add_submission(assignment_id, msg.from_user.id, msg.from_user.full_name, text=(msg.text or ""), file_meta=file_meta, message_id=msg.message_id)
+    if file_meta:
+        # Downloaded into the blob store by the API's outbox worker (server/file_fetch.py)
+        await aio.outbox.request_file_fetch(file_meta["file_id"])
     try:
-        await msg.reply_text(f"✅ Submission received for {found['assignment_id']} (ID: {sub['submission_id']}).")
+        await msg.reply_text(f"✅ Submission received for {assignment_id} (ID: {sub['submission_id']}).")
     except Exception:
         pass
-    # DM snapshot to teacher
-    cls = storage.get_class(int(group_id))
+    # Queue a snapshot DM for the teacher (sent by the API's outbox worker)
+    cls = await aio.storage.get_class(int(group_id))
     if cls:
-        send_teacher_snapshot(cls["teacher_tg_id"])
+        await aio.outbox.request_snapshot(cls["teacher_tg_id"])
+
+def build_application(polling: bool = True) -> Application:
+    """The bot with its handlers; without polling, updates are fed in by the webhook."""
+    builder = ApplicationBuilder().token(TOKEN).concurrent_updates(CONCURRENT_UPDATES)
+    if not polling:
+        builder = builder.updater(None)
+    app = builder.build()
+    app.add_handler(CommandHandler("start", in_order(start)))
+    app.add_handler(CommandHandler("dashboard", in_order(dashboard)))
+    app.add_handler(CommandHandler("init_class", in_order(init_class)))
+    app.add_handler(MessageHandler(filters.REPLY & filters.ChatType.GROUPS & (~filters.COMMAND), in_order(reply_capture)))
+    return app
 
 def main():
-    app = ApplicationBuilder().token(TOKEN).build()
-    app.add_handler(CommandHandler("start", start))
-    app.add_handler(CommandHandler("dashboard", dashboard))
-    app.add_handler(CommandHandler("init_class", init_class))
-    app.add_handler(MessageHandler(filters.ALL & (~filters.COMMAND), reply_capture))
+    if WEBHOOK_URL:
+        # Idle rather than exit, so a supervisor (docker-compose's restart policy) doesn't
+        # restart the bot in a loop.
+        print("NOETICA_WEBHOOK_URL is set: updates go to the API server's webhook; not polling")
+        threading.Event().wait()
+        return
+    app = build_application()
     print("Bot polling…")
     app.run_polling()
 
@@ -1,21 +1,30 @@
 # server/app.py
-import os, hmac, hashlib, urllib.parse
-from typing import Optional
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Depends
+import os, hmac, hashlib, urllib.parse, asyncio, json, threading, time
+from collections import OrderedDict
+from typing import Optional, Tuple, List
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Depends, Request, BackgroundTasks, Query
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from dotenv import load_dotenv
-from storage import storage
-from server.telegram_api import (post_assignment_to_group, edit_message_text,
-                                 send_teacher_snapshot, send_reminder)
+# Before the project imports below: storage and the server modules read their settings
+# (backend, webhook, pool sizes, ...) from the environment when they are imported.
+load_dotenv()
+from storage import storage, aio
+from server import telegram_api
+from storage.outbox import request_snapshot, queue_missing_file_fetches
+from storage.quiz import recover_attempt_shards
+from server import outbox, loop_lag, bot_webhook
+from server.telegram_api import post_assignment_to_group, edit_message_text, send_reminder
 from pathlib import Path
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import RedirectResponse, FileResponse
+from fastapi.responses import RedirectResponse
+from server.files import file_response, csv_response
 
-load_dotenv()
 BOT_TOKEN = os.environ.get("NOETICA_BOT_TOKEN") or ""
 WEBAPP_URL = os.environ.get("WEBAPP_URL") or ""
 DEV_SKIP = (os.environ.get("DEV_SKIP_INITDATA_VALIDATION","").lower() == "true")
+INIT_DATA_MAX_AGE = int(os.environ.get("NOETICA_INIT_DATA_MAX_AGE") or 86400)
+INIT_DATA_CACHE_SIZE = 4096
 
 app = FastAPI(title="Noetica LMS (file DB)")
 
@@ -24,23 +33,97 @@ app.add_middleware(
     allow_origins=["*"], allow_credentials=True, allow_methods=["*"], allow_headers=["*"],
 )
 
-# --- Telegram WebApp initData validation (simplified) ---
-def validate_init_data(init_data: str) -> dict:
-    """
-    DEV: if DEV_SKIP=true, accept without signature.
-    In production: implement per Telegram docs (HMAC SHA256, 'hash' field).
-    """
+@app.on_event("startup")
+def clean_up_attempt_shards():
+    removed = recover_attempt_shards()
+    if removed:
+        print(f"Removed {removed} answer shard(s) of finished quiz attempts")
+
+@app.on_event("startup")
+def queue_file_fetches():
+    queued = queue_missing_file_fetches()
+    if queued:
+        print(f"Queued {queued} bot-submitted file(s) for download")
+
+@app.on_event("startup")
+async def start_outbox_worker():
+    app.state.outbox_worker = asyncio.create_task(outbox.run())
+    app.state.loop_lag_monitor = asyncio.create_task(loop_lag.run())
+
+@app.on_event("startup")
+async def start_bot_webhook():
+    if bot_webhook.WEBHOOK_URL:
+        await bot_webhook.start()
+
+@app.on_event("shutdown")
+async def close_telegram_client():
+    app.state.outbox_worker.cancel()
+    app.state.loop_lag_monitor.cancel()
+    await bot_webhook.stop()
+    await telegram_api.aclose()
+    aio.shutdown()
+
+# --- Telegram WebApp initData validation ---
+# Telegram signs initData with HMAC_SHA256(key=HMAC_SHA256("WebAppData", bot_token)).
+# The Mini App sends the same initData with every call, so verified strings are kept in a
+# small LRU (initData -> parsed fields, user id, expiry) and only the expiry is re-checked.
+_INIT_DATA_KEY = hmac.new(b"WebAppData", BOT_TOKEN.encode(), hashlib.sha256).digest()
+_verified: "OrderedDict[str, Tuple[dict, Optional[int], float]]" = OrderedDict()
+_verified_lock = threading.Lock()
+
+def _user_id(parsed: dict) -> Optional[int]:
+    try:
+        return int(json.loads(parsed["user"])["id"]) if "user" in parsed else None
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(401, "Invalid user in initData")
+
+def _verify_init_data(init_data: str) -> Tuple[dict, Optional[int], float]:
     try:
-        parsed = dict(urllib.parse.parse_qsl(init_data, keep_blank_values=True))
+        parsed = dict(urllib.parse.parse_qsl(init_data, keep_blank_values=True, strict_parsing=True))
     except Exception:
         raise HTTPException(401, "Invalid initData format")
+    received = parsed.pop("hash", "")
+    check_string = "\n".join(f"{k}={v}" for k, v in sorted(parsed.items()))
+    expected = hmac.new(_INIT_DATA_KEY, check_string.encode(), hashlib.sha256).hexdigest()
+    if not hmac.compare_digest(expected.encode(), received.encode()):
+        raise HTTPException(401, "Invalid initData signature")
+    try:
+        auth_date = int(parsed["auth_date"])
+    except (KeyError, ValueError):
+        raise HTTPException(401, "Missing auth_date in initData")
+    return parsed, _user_id(parsed), auth_date + INIT_DATA_MAX_AGE
+
+def _checked_init_data(init_data: str) -> Tuple[dict, Optional[int]]:
+    """Parsed initData fields and user id, verifying the signature unless DEV_SKIP."""
     if DEV_SKIP:
-        return parsed
-    # TODO: Implement strict HMAC validation here per Telegram docs.
-    # For now, require user field to exist.
-    if "user" not in parsed:
-        raise HTTPException(401, "Missing user in initData")
-    return parsed
+        try:
+            parsed = dict(urllib.parse.parse_qsl(init_data, keep_blank_values=True))
+        except Exception:
+            raise HTTPException(401, "Invalid initData format")
+        return parsed, _user_id(parsed)
+    with _verified_lock:
+        hit = _verified.get(init_data)
+        if hit:
+            _verified.move_to_end(init_data)
+    if hit is None:
+        hit = _verify_init_data(init_data)
+        with _verified_lock:
+            _verified[init_data] = hit
+            if len(_verified) > INIT_DATA_CACHE_SIZE:
+                _verified.popitem(last=False)
+    parsed, user_id, expires_at = hit
+    if time.time() >= expires_at:
+        with _verified_lock:
+            _verified.pop(init_data, None)
+        raise HTTPException(401, "initData expired")
+    return parsed, user_id
+
+def validate_init_data(init_data: str) -> dict:
+    """
+    DEV: if DEV_SKIP=true, accept without signature.
+    Otherwise check the 'hash' signature and that auth_date is within INIT_DATA_MAX_AGE.
+    """
+    return _checked_init_data(init_data)[0]
 
 # --- Schemas ---
 class LinkClassPayload(BaseModel):
@@ -65,22 +148,21 @@ def current_user_id(init_data: Optional[str] = None):
     from fastapi import Request
     def dep(request: Request):
         hdr = request.headers.get("x-telegram-init-data", "")
-        parsed = validate_init_data(hdr)
+        _, user_id = _checked_init_data(hdr)
         # user id is inside 'user' JSON (when strict); in DEV we accept absent.
-        # To keep dev moving, allow override with x-dev-user-id
+        # To keep dev moving, allow override with x-dev-user-id (DEV only)
         dev_uid = request.headers.get("x-dev-user-id")
-        if dev_uid:
+        if dev_uid and DEV_SKIP:
             return int(dev_uid)
-        if "user" in parsed:
-            import json as _json
-            u = _json.loads(parsed["user"])
-            return int(u["id"])
+        if user_id is not None:
+            return user_id
         raise HTTPException(401, "No user in initData (DEV: set DEV_SKIP_INITDATA_VALIDATION=true or x-dev-user-id)")
     return dep
 
 @app.get("/api/health")
 def health():
-    return {"ok": True}
+    return {"ok": True, "storage": storage.lock_stats(), "storage_pool": aio.pool_stats(),
+            "event_loop": loop_lag.stats()}
 
 @app.post("/api/auth/verify")
 def verify_auth(user_id: int = Depends(current_user_id())):
@@ -113,20 +195,26 @@ def verify_auth(user_id: int = Depends(current_user_id())):
 def link_class(payload: LinkClassPayload, user_id: int = Depends(current_user_id())):
     storage.ensure_teacher(user_id, name=f"tg:{user_id}")
     cls = storage.link_class(payload.group_chat_id, payload.group_title, user_id)
-    send_teacher_snapshot(user_id)
+    request_snapshot(user_id)
     return cls
 
-# --- Teacher: create assignment (posts to group) ---
+# --- Teacher: create assignment (posts to group after responding) ---
+async def publish_assignment(a: dict):
+    try:
+        msg_id = await post_assignment_to_group(int(a["class_id"]), a["assignment_id"], a["title"], a["due_at"], a["instructions_md"])
+        await aio.run(storage.set_assignment_message_id, a["assignment_id"], msg_id)
+    except Exception as e:
+        print("Assignment post failed:", e)
+
 @app.post("/api/assignments")
-def create_assignment(payload: CreateAssignmentPayload, user_id: int = Depends(current_user_id())):
+def create_assignment(payload: CreateAssignmentPayload, background: BackgroundTasks, user_id: int = Depends(current_user_id())):
     cls = storage.get_class(int(payload.class_id))
     if not cls or cls["teacher_tg_id"] != user_id:
         raise HTTPException(403, "Not your class")
     a = storage.create_assignment(payload.class_id, payload.title, payload.instructions_md or "", payload.due_at)
-    msg_id = post_assignment_to_group(int(payload.class_id), a["assignment_id"], a["title"], a["due_at"], a["instructions_md"])
-    storage.set_assignment_message_id(a["assignment_id"], msg_id)
-    send_teacher_snapshot(user_id)
-    return storage.get_assignment(a["assignment_id"])
+    background.add_task(publish_assignment, a)
+    request_snapshot(user_id)
+    return a
 
 # --- Teacher: list assignments ---
 @app.get("/api/assignments")
@@ -137,8 +225,14 @@ def list_assignments(class_id: str, user_id: int = Depends(current_user_id())):
     return storage.list_assignments(class_id)
 
 # --- Teacher: update assignment (edit message if needed) ---
+async def edit_assignment_post(a: dict, text: str):
+    try:
+        await edit_message_text(int(a["class_id"]), int(a["posted_message_id"]), text, parse_mode="Markdown")
+    except Exception as e:
+        print("Edit failed:", e)
+
 @app.patch("/api/assignments/{assignment_id}")
-def update_assignment(assignment_id: str, payload: UpdateAssignmentPayload, user_id: int = Depends(current_user_id())):
+def update_assignment(assignment_id: str, payload: UpdateAssignmentPayload, background: BackgroundTasks, user_id: int = Depends(current_user_id())):
     a = storage.get_assignment(assignment_id)
     if not a:
         raise HTTPException(404, "Assignment not found")
@@ -153,11 +247,8 @@ def update_assignment(assignment_id: str, payload: UpdateAssignmentPayload, user
         if updated.get("instructions_md"): lines.append(f"\n{updated['instructions_md']}")
         lines.append("\nReply to *this message* with your document/file.")
         text = "\n".join(lines)
-        try:
-            edit_message_text(int(updated["class_id"]), int(updated["posted_message_id"]), text, parse_mode="Markdown")
-        except Exception as e:
-            print("Edit failed:", e)
-    send_teacher_snapshot(user_id)
+        background.add_task(edit_assignment_post, updated, text)
+    request_snapshot(user_id)
     return updated
 
 # --- Teacher: view submissions (read-only) ---
@@ -171,28 +262,60 @@ def list_submissions(assignment_id: str, user_id: int = Depends(current_user_id(
     return storage.list_submissions(assignment_id)
 
 # --- Teacher: reminder ---
+async def post_reminder(a: dict):
+    try:
+        await send_reminder(int(a["class_id"]), a["assignment_id"], a["title"], a["due_at"])
+    except Exception as e:
+        print("Reminder failed:", e)
+
 @app.post("/api/assignments/{assignment_id}/remind")
-def remind(assignment_id: str, user_id: int = Depends(current_user_id())):
+def remind(assignment_id: str, background: BackgroundTasks, user_id: int = Depends(current_user_id())):
     a = storage.get_assignment(assignment_id)
     if not a: raise HTTPException(404, "Assignment not found")
     cls = storage.get_class(int(a["class_id"]))
     if not cls or cls["teacher_tg_id"] != user_id:
         raise HTTPException(403, "Not your class")
-    send_reminder(int(a["class_id"]), a["assignment_id"], a["title"], a["due_at"])
-    send_teacher_snapshot(user_id)
+    background.add_task(post_reminder, a)
+    request_snapshot(user_id)
     return {"ok": True}
 
 # --- Teacher: export CSV (server writes file; bot can DM, or just returns path) ---
 @app.post("/api/assignments/{assignment_id}/export_csv")
-def export_csv(assignment_id: str, user_id: int = Depends(current_user_id())):
+def export_csv(assignment_id: str, gzip: bool = False, user_id: int = Depends(current_user_id())):
     a = storage.get_assignment(assignment_id)
     if not a: raise HTTPException(404, "Assignment not found")
     cls = storage.get_class(int(a["class_id"]))
     if not cls or cls["teacher_tg_id"] != user_id:
         raise HTTPException(403, "Not your class")
-    path = storage.export_submissions_csv(assignment_id)
-    # For simplicity, just return the file path (bot can DM separately if desired)
-    return {"csv_path": path}
+    return csv_response(storage.iter_submissions_csv([assignment_id]), f"submissions_{assignment_id}.csv", gzip)
+
+# --- Teacher: class-wide exports ---
+@app.get("/api/classes/{class_id}/export/submissions.csv")
+def export_class_submissions(class_id: str, assignment_id: List[str] = Query(default=[]), gzip: bool = False,
+                             user_id: int = Depends(current_user_id())):
+    """Submissions to the given assignments of the class (repeat ?assignment_id=), or to all of them."""
+    cls = storage.get_class(int(class_id))
+    if not cls or cls["teacher_tg_id"] != user_id:
+        raise HTTPException(403, "Not your class")
+    own = [a["assignment_id"] for a in storage.list_assignments(class_id)]
+    if set(assignment_id) - set(own):
+        raise HTTPException(404, "Assignment not found in this class")
+    return csv_response(storage.iter_submissions_csv(assignment_id or own), f"submissions_{class_id}.csv", gzip)
+
+@app.get("/api/classes/{class_id}/export/gradebook.csv")
+def export_gradebook(class_id: str, gzip: bool = False, user_id: int = Depends(current_user_id())):
+    cls = storage.get_class(int(class_id))
+    if not cls or cls["teacher_tg_id"] != user_id:
+        raise HTTPException(403, "Not your class")
+    return csv_response(storage.iter_gradebook_csv(class_id), f"gradebook_{class_id}.csv", gzip)
+
+@app.get("/api/classes/{class_id}/gradebook")
+def class_gradebook(class_id: str, offset: int = Query(0, ge=0), limit: int = Query(100, ge=1, le=500),
+                    user_id: int = Depends(current_user_id())):
+    cls = storage.get_class(int(class_id))
+    if not cls or cls["teacher_tg_id"] != user_id:
+        raise HTTPException(403, "Not your class")
+    return storage.get_gradebook(class_id, offset, limit)
 
 
 ROOT_DIR = Path(__file__).resolve().parents[1]
@@ -207,6 +330,7 @@ from server.student_api import router as student_router
 from server.quiz_api import router as quiz_router
 app.include_router(student_router)
 app.include_router(quiz_router)
+app.include_router(bot_webhook.router)
 
 # Serve static files for the mini app
 app.mount(
@@ -225,17 +349,12 @@ app.mount(
 
 # Serve files from the data/files directory
 @app.get("/api/files/{file_id}")
-async def get_file(file_id: str):
-    # Find the file in the submissions
-    data = storage.load()
-    for submission in data["submissions"].values():
-        if submission.get("file") and submission["file"].get("file_id") == file_id:
-            file_path = submission["file"].get("local_path")
-            if file_path and os.path.exists(file_path):
-                return FileResponse(
-                    path=file_path,
-                    filename=submission["file"].get("filename", f"file_{file_id}"),
-                    media_type=submission["file"].get("mime", "application/octet-stream")
-                )
-    
-    raise HTTPException(404, "File not found")
\ No newline at end of file
+def get_file(file_id: str, request: Request):
+    meta = storage.get_file_meta(file_id)
+    file_path = (meta or {}).get("local_path")
+    if not file_path or not os.path.exists(file_path):
+        raise HTTPException(404, "File not found")
+    return file_response(request, file_path,
+                         filename=meta.get("filename") or f"file_{file_id}",
+                         media_type=meta.get("mime") or "application/octet-stream",
+                         digest=meta.get("sha256"))
@@ -0,0 +1,49 @@
+# server/bot_webhook.py
+"""
+Webhook mode for the Telegram bot, enabled by NOETICA_WEBHOOK_URL.
+
+Instead of running bot/bot.py as a poller, the API server hosts the bot: at startup it
+starts the bot application without an updater and registers the webhook with Telegram.
+POST /api/telegram/webhook queues each update and answers at once; the bot handles queued
+updates concurrently, keeping each sender's updates in a chat in order (bot.in_order).
+Telegram sends NOETICA_WEBHOOK_SECRET with every call, and requests without it are refused.
+"""
+import os, secrets
+from fastapi import APIRouter, HTTPException, Request
+from telegram import Update
+
+WEBHOOK_URL = os.environ.get("NOETICA_WEBHOOK_URL") or ""
+WEBHOOK_SECRET = os.environ.get("NOETICA_WEBHOOK_SECRET") or ""
+
+router = APIRouter(prefix="/api/telegram", tags=["telegram"])
+_application = None
+
+async def start():
+    global _application
+    if not WEBHOOK_SECRET:
+        raise RuntimeError("NOETICA_WEBHOOK_SECRET must be set when NOETICA_WEBHOOK_URL is")
+    from bot.bot import build_application   # imported here: the bot module requires NOETICA_BOT_TOKEN
+    application = build_application(polling=False)
+    await application.initialize()
+    await application.start()
+    await application.bot.set_webhook(WEBHOOK_URL, secret_token=WEBHOOK_SECRET, allowed_updates=Update.ALL_TYPES)
+    _application = application
+
+async def stop():
+    if _application:
+        await _application.stop()
+        await _application.shutdown()
+
+@router.post("/webhook")
+async def telegram_webhook(request: Request):
+    if _application is None:
+        raise HTTPException(404, "Webhook mode is not enabled")
+    token = request.headers.get("x-telegram-bot-api-secret-token", "")
+    if not secrets.compare_digest(token, WEBHOOK_SECRET):
+        raise HTTPException(403, "Invalid webhook secret")
+    try:
+        update = Update.de_json(await request.json(), _application.bot)
+    except Exception:
+        raise HTTPException(400, "Invalid update")
+    await _application.update_queue.put(update)
+    return {"ok": True}
@@ -0,0 +1,43 @@
+# server/file_fetch.py
+"""
+Downloads of files students submitted through the bot.
+
+The bot only learns a Telegram file_id, so each such submission queues a 'fetch_file'
+outbox job (storage/outbox.py). The outbox worker runs them here, at most
+FETCH_CONCURRENCY at a time (the rest stay queued): the file is resolved with getFile,
+streamed to a temp file while being hashed and moved into the blob store, and its
+local_path, size and sha256 are filled in, after which /api/files and the CSV export
+serve it like any upload.
+"""
+import os, hashlib, tempfile
+from typing import Dict, Any
+from starlette.concurrency import run_in_threadpool
+from storage.storage import FILES_DIR, update_file_meta
+from storage import blobs, aio
+from server import telegram_api
+
+FETCH_CONCURRENCY = int(os.environ.get("NOETICA_FETCH_CONCURRENCY") or 4)
+# file ids being downloaded: bounds concurrency, and a job whose lease ran out
+# mid-download is not started twice
+in_flight = set()
+
+async def fetch(file_id: str) -> Dict[str, Any]:
+    """Download a bot-submitted file into the blob store; returns its updated metadata."""
+    info = await telegram_api.get_file(file_id)
+    hasher, size = hashlib.sha256(), 0
+    # .upload_ temp files that are left behind are removed by `python -m storage.blobs gc`
+    fd, tmp_path = tempfile.mkstemp(prefix=".upload_", dir=FILES_DIR)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            async for chunk in telegram_api.download_file(info["file_path"]):
+                size += len(chunk)
+                hasher.update(chunk)
+                await run_in_threadpool(f.write, chunk)
+            await run_in_threadpool(os.fsync, f.fileno())
+        path = await run_in_threadpool(blobs.put, tmp_path, hasher.hexdigest())
+    except BaseException:
+        try: os.remove(tmp_path)
+        except FileNotFoundError: pass
+        raise
+    return await aio.run(update_file_meta, file_id, local_path=path, size=size,
+                         sha256=hasher.hexdigest())
@@ -0,0 +1,111 @@
+# server/files.py
+"""
+Responses for downloading stored files: ETag / If-None-Match revalidation and
+single-range requests, so resumed downloads pick up where they stopped. Also streamed
+CSV exports, optionally gzip-compressed on the fly.
+"""
+import os, urllib.parse, zlib
+from typing import Optional, Iterator
+from fastapi import Request
+from fastapi.responses import FileResponse, Response, StreamingResponse
+
+CHUNK_SIZE = 256 * 1024
+
+def _etag(st: os.stat_result, digest: Optional[str]) -> str:
+    return f'"{digest}"' if digest else f'"{st.st_size:x}-{st.st_mtime_ns:x}"'
+
+def _parse_range(header: str, size: int):
+    """
+    (start, end) inclusive for a single 'bytes=' range, None to send everything (no usable
+    range: invalid ones are ignored, RFC 9110 14.2), False if valid but unsatisfiable.
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None  # unknown unit or multipart ranges: fall back to the full body
+    first, _, last = spec.strip().partition("-")
+    try:
+        if first:
+            start = int(first)
+            end = int(last) if last else size - 1
+            if last and end < start:
+                return None
+        else:
+            start, end = size - int(last), size - 1
+    except ValueError:
+        return None
+    start, end = max(start, 0), min(end, size - 1)
+    if start > end or start >= size:
+        return False
+    return start, end
+
+def _iter_range(path: str, start: int, length: int):
+    # Sync generator: Starlette runs it in the threadpool, off the event loop.
+    with open(path, "rb") as f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+def file_response(request: Request, path: str, filename: str, media_type: str,
+                  digest: Optional[str] = None) -> Response:
+    st = os.stat(path)
+    etag = _etag(st, digest)
+    headers = {"ETag": etag, "Accept-Ranges": "bytes", "Cache-Control": "private, max-age=3600"}
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and (if_none_match.strip() == "*" or etag in [t.strip() for t in if_none_match.split(",")]):
+        return Response(status_code=304, headers=headers)
+
+    rng = None
+    range_header = request.headers.get("range")
+    if range_header and request.headers.get("if-range", etag) == etag:
+        rng = _parse_range(range_header, st.st_size)
+    if rng is False:
+        return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{st.st_size}"})
+    if rng is None:
+        # Whole file: FileResponse hands the path to the server (zero-copy where supported).
+        return FileResponse(path=path, filename=filename, media_type=media_type, headers=headers, stat_result=st)
+
+    start, end = rng
+    headers.update({
+        "Content-Range": f"bytes {start}-{end}/{st.st_size}",
+        "Content-Length": str(end - start + 1),
+        "Content-Disposition": f"attachment; filename*=utf-8''{urllib.parse.quote(filename)}",
+    })
+    return StreamingResponse(_iter_range(path, start, end - start + 1), status_code=206,
+                             media_type=media_type, headers=headers)
+
+def _batched(lines: Iterator[str]) -> Iterator[bytes]:
+    """Join generated text lines into chunks of about CHUNK_SIZE bytes."""
+    buf, size = [], 0
+    for line in lines:
+        data = line.encode("utf-8")
+        buf.append(data)
+        size += len(data)
+        if size >= CHUNK_SIZE:
+            yield b"".join(buf)
+            buf, size = [], 0
+    if buf:
+        yield b"".join(buf)
+
+def _gzipped(chunks: Iterator[bytes]) -> Iterator[bytes]:
+    z = zlib.compressobj(6, zlib.DEFLATED, 31)   # wbits=31: gzip container
+    for chunk in chunks:
+        out = z.compress(chunk)
+        if out:
+            yield out
+    yield z.flush()
+
+def csv_response(lines: Iterator[str], filename: str, gzip: bool = False) -> StreamingResponse:
+    """Stream CSV lines as a download, compressed if `gzip`; nothing is written to disk."""
+    # Sync generators: Starlette pulls them in the threadpool, so the storage reads stay off the loop.
+    body = _batched(lines)
+    media_type = "text/csv; charset=utf-8"
+    if gzip:
+        body, media_type, filename = _gzipped(body), "application/gzip", filename + ".gz"
+    headers = {"Content-Disposition": f"attachment; filename*=utf-8''{urllib.parse.quote(filename)}",
+               "Cache-Control": "no-store"}
+    return StreamingResponse(body, media_type=media_type, headers=headers)
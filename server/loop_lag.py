@@ -0,0 +1,42 @@
+# server/loop_lag.py
+"""
+Event-loop lag monitor.
+
+Sleeps for a fixed interval and measures how late it wakes up: the overshoot is time the
+loop spent running something that did not yield (e.g. a blocking call in an async
+route). Stalls longer than LAG_WARN_SECONDS are printed; the figures are served by
+/api/health.
+"""
+import asyncio, time
+from collections import deque
+
+INTERVAL_SECONDS = 0.1
+LAG_WARN_SECONDS = 0.25
+WINDOW = 600   # samples kept, i.e. the last minute
+
+_samples = deque(maxlen=WINDOW)
+_max_lag = 0.0
+
+async def run():
+    global _max_lag
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(INTERVAL_SECONDS)
+        lag = max(0.0, time.perf_counter() - start - INTERVAL_SECONDS)
+        _samples.append(lag)
+        _max_lag = max(_max_lag, lag)
+        if lag > LAG_WARN_SECONDS:
+            print(f"Event loop blocked for {lag * 1000:.0f} ms")
+
+def stats() -> dict:
+    """Lag over the last minute (mean, p99, max) and the worst since startup, in ms."""
+    recent = sorted(_samples)
+    if not recent:
+        return {"samples": 0}
+    return {
+        "samples": len(recent),
+        "mean_ms": round(sum(recent) / len(recent) * 1000, 2),
+        "p99_ms": round(recent[min(len(recent) - 1, int(len(recent) * 0.99))] * 1000, 2),
+        "max_ms": round(recent[-1] * 1000, 2),
+        "max_since_start_ms": round(_max_lag * 1000, 2),
+    }
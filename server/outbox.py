@@ -0,0 +1,69 @@
+# server/outbox.py
+"""
+Background worker that drains the notification outbox (storage/outbox.py).
+
+Runs inside the API process. Each due snapshot job edits the teacher's pinned snapshot
+message, or sends and pins a new one if there is none yet. File fetch jobs download
+bot-submitted files (server/file_fetch.py) in the background, several at a time.
+Failures are retried with exponential backoff.
+"""
+import asyncio
+from storage import storage, aio
+from storage.storage import update_file_meta
+from storage.outbox import claim_outbox, finish_outbox, set_snapshot_message_id
+from server.telegram_api import send_teacher_snapshot
+from server import file_fetch
+
+POLL_SECONDS = 1.0
+LEASE_SECONDS = 60
+MAX_ATTEMPTS = 5
+
+async def _deliver(job):
+    teacher = await aio.run(storage.get_teacher, job["teacher_tg_id"]) or {}
+    current = teacher.get("snapshot_message_id")
+    try:
+        message_id = await send_teacher_snapshot(job["teacher_tg_id"], current)
+    except Exception as e:
+        print("Snapshot send failed:", e)
+        retry = job["attempts"] + 1 < MAX_ATTEMPTS
+        await aio.run(finish_outbox, job, 2 ** job["attempts"] * 5 if retry else None)
+        return
+    if message_id != current:
+        await aio.run(set_snapshot_message_id, job["teacher_tg_id"], message_id)
+    await aio.run(finish_outbox, job)
+
+async def _fetch(job):
+    try:
+        await file_fetch.fetch(job["file_id"])
+    except Exception as e:
+        print("File fetch failed:", e)
+        retry = job["attempts"] + 1 < MAX_ATTEMPTS
+        if not retry:
+            # keeps queue_missing_file_fetches() from queueing it again
+            await aio.run(update_file_meta, job["file_id"], fetch_failed=True)
+        await aio.run(finish_outbox, job, 2 ** job["attempts"] * 5 if retry else None)
+    else:
+        await aio.run(finish_outbox, job)
+    finally:
+        file_fetch.in_flight.discard(job["file_id"])
+
+async def run():
+    fetches = set()
+    while True:
+        try:
+            # Fetch jobs are only leased when a download slot is free, so a backlog waits unleased.
+            limits = {"fetch_file": file_fetch.FETCH_CONCURRENCY - len(file_fetch.in_flight)}
+            for job in await aio.run(claim_outbox, LEASE_SECONDS, limits):
+                if job["kind"] == "snapshot":
+                    await _deliver(job)
+                elif job["kind"] == "fetch_file":
+                    if job["file_id"] not in file_fetch.in_flight:
+                        file_fetch.in_flight.add(job["file_id"])
+                        task = asyncio.create_task(_fetch(job))
+                        fetches.add(task)
+                        task.add_done_callback(fetches.discard)
+                else:
+                    await aio.run(finish_outbox, job)
+        except Exception as e:
+            print("Outbox worker error:", e)
+        await asyncio.sleep(POLL_SECONDS)
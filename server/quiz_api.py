@@ -2,13 +2,8 @@
 from typing import List, Optional, Any, Dict
 from fastapi import APIRouter, Depends, HTTPException
 from pydantic import BaseModel
-from storage import storage
-from storage.quiz import (
-    create_quiz, update_quiz, get_quiz, list_quizzes,
-    add_question, update_question, delete_question, list_questions,
-    start_quiz_attempt, answer_question, complete_quiz_attempt,
-    get_quiz_attempt, list_student_quiz_attempts, list_quiz_attempts
-)
+from storage import aio
+from storage.quiz_analytics import best_scores
 from server.app import current_user_id
 
 router = APIRouter(prefix="/api/quiz", tags=["quiz"])
@@ -51,6 +46,10 @@ class AnswerRequest(BaseModel):
     question_id: str
     answer: Any
 
+class BulkAnswerRequest(BaseModel):
+    answers: List[AnswerRequest]
+    complete: bool = False
+
 # --- Teacher Routes ---
 @router.post("/teacher/quizzes")
 async def teacher_create_quiz(
@@ -59,12 +58,12 @@ async def teacher_create_quiz(
 ):
     """Create a new quiz"""
     # Check if class exists and teacher owns it
-    cls = storage.get_class(int(request.class_id))
+    cls = await aio.storage.get_class(int(request.class_id))
     if not cls or cls["teacher_tg_id"] != user_id:
         raise HTTPException(403, "Not your class")
     
     # Create quiz
-    quiz = create_quiz(
+    quiz = await aio.quiz.create_quiz(
         request.class_id,
         request.title,
         request.description,
@@ -82,17 +81,20 @@ async def teacher_list_quizzes(
 ):
     """List quizzes for a class"""
     # Check if class exists and teacher owns it
-    cls = storage.get_class(int(class_id))
+    cls = await aio.storage.get_class(int(class_id))
     if not cls or cls["teacher_tg_id"] != user_id:
         raise HTTPException(403, "Not your class")
     
     # List quizzes
-    quizzes = list_quizzes(class_id)
+    quizzes = await aio.quiz.list_quizzes(class_id)
     
-    # Add question count and attempt count to each quiz
-    for quiz in quizzes:
-        quiz["question_count"] = len(list_questions(quiz["quiz_id"]))
-        quiz["attempt_count"] = len(list_quiz_attempts(quiz["quiz_id"]))
+    # Add question count and attempt count to each quiz (copies: storage records are shared)
+    quizzes = [
+        {**quiz,
+         "question_count": len(await aio.quiz.list_questions(quiz["quiz_id"])),
+         "attempt_count": len(await aio.quiz.list_quiz_attempts(quiz["quiz_id"]))}
+        for quiz in quizzes
+    ]
     
     return {"quizzes": quizzes}
 
@@ -103,42 +105,30 @@ async def teacher_get_quiz(
 ):
     """Get a quiz with questions and attempts"""
     # Get quiz
-    quiz = get_quiz(quiz_id)
+    quiz = await aio.quiz.get_quiz(quiz_id)
     if not quiz:
         raise HTTPException(404, "Quiz not found")
     
     # Check if teacher owns the class
-    cls = storage.get_class(int(quiz["class_id"]))
+    cls = await aio.storage.get_class(int(quiz["class_id"]))
     if not cls or cls["teacher_tg_id"] != user_id:
         raise HTTPException(403, "Not your class")
     
     # Get questions and attempts
-    questions = list_questions(quiz_id)
-    attempts = list_quiz_attempts(quiz_id)
-    
-    # Group attempts by student
-    student_attempts = {}
-    for attempt in attempts:
-        student_id = attempt["student_tg_id"]
-        if student_id not in student_attempts:
-            student_attempts[student_id] = []
-        student_attempts[student_id].append(attempt)
-    
-    # Format student data
+    questions = await aio.quiz.list_questions(quiz_id)
+    attempts = await aio.quiz.list_quiz_attempts(quiz_id)
+    
+    # Attempt count and best score per student
     students = []
-    for student_id, student_attempts_list in student_attempts.items():
+    for student_id, summary in best_scores(attempts).items():
         # Get student name
-        student = storage.get_student(student_id)
+        student = await aio.storage.get_student(student_id)
         student_name = student["name"] if student else f"Student {student_id}"
         
-        # Get best score
-        best_score = max([a["score"] for a in student_attempts_list if a["score"] is not None], default=None)
-        
         students.append({
             "student_id": student_id,
             "student_name": student_name,
-            "attempt_count": len(student_attempts_list),
-            "best_score": best_score
+            **summary
         })
     
     return {
@@ -155,22 +145,58 @@ async def teacher_update_quiz(
 ):
     """Update a quiz"""
     # Get quiz
-    quiz = get_quiz(quiz_id)
+    quiz = await aio.quiz.get_quiz(quiz_id)
     if not quiz:
         raise HTTPException(404, "Quiz not found")
     
     # Check if teacher owns the class
-    cls = storage.get_class(int(quiz["class_id"]))
+    cls = await aio.storage.get_class(int(quiz["class_id"]))
     if not cls or cls["teacher_tg_id"] != user_id:
         raise HTTPException(403, "Not your class")
     
     # Update quiz
-    updated_quiz = update_quiz(quiz_id, **request.model_dump(exclude_none=True))
+    updated_quiz = await aio.quiz.update_quiz(quiz_id, **request.model_dump(exclude_none=True))
     if not updated_quiz:
         raise HTTPException(404, "Quiz not found")
     
     return updated_quiz
 
+@router.post("/teacher/quizzes/{quiz_id}/regrade")
+async def teacher_regrade_quiz(
+    quiz_id: str,
+    user_id: int = Depends(current_user_id())
+):
+    """Rescore every completed attempt against the quiz's current answer key"""
+    # Get quiz
+    quiz = await aio.quiz.get_quiz(quiz_id)
+    if not quiz:
+        raise HTTPException(404, "Quiz not found")
+    
+    # Check if teacher owns the class
+    cls = await aio.storage.get_class(int(quiz["class_id"]))
+    if not cls or cls["teacher_tg_id"] != user_id:
+        raise HTTPException(403, "Not your class")
+    
+    return await aio.quiz_analytics.regrade_quiz(quiz_id)
+
+@router.get("/teacher/quizzes/{quiz_id}/analysis")
+async def teacher_quiz_analysis(
+    quiz_id: str,
+    user_id: int = Depends(current_user_id())
+):
+    """Item analysis of a quiz's completed attempts"""
+    # Get quiz
+    quiz = await aio.quiz.get_quiz(quiz_id)
+    if not quiz:
+        raise HTTPException(404, "Quiz not found")
+    
+    # Check if teacher owns the class
+    cls = await aio.storage.get_class(int(quiz["class_id"]))
+    if not cls or cls["teacher_tg_id"] != user_id:
+        raise HTTPException(403, "Not your class")
+    
+    return await aio.quiz_analytics.item_analysis(quiz_id)
+
 @router.post("/teacher/questions")
 async def teacher_add_question(
     request: QuestionCreateRequest,
@@ -178,12 +204,12 @@ async def teacher_add_question(
 ):
     """Add a question to a quiz"""
     # Get quiz
-    quiz = get_quiz(request.quiz_id)
+    quiz = await aio.quiz.get_quiz(request.quiz_id)
     if not quiz:
         raise HTTPException(404, "Quiz not found")
     
     # Check if teacher owns the class
-    cls = storage.get_class(int(quiz["class_id"]))
+    cls = await aio.storage.get_class(int(quiz["class_id"]))
     if not cls or cls["teacher_tg_id"] != user_id:
         raise HTTPException(403, "Not your class")
     
@@ -192,7 +218,7 @@ async def teacher_add_question(
         raise HTTPException(400, "Cannot modify questions for a published quiz")
     
     # Add question
-    question = add_question(
+    question = await aio.quiz.add_question(
         request.quiz_id,
         request.question_text,
         request.question_type,
@@ -211,31 +237,33 @@ async def teacher_update_question(
 ):
     """Update a question"""
     # Get question
-    data = storage.load()
-    if "questions" not in data or question_id not in data["questions"]:
+    question = await aio.quiz.get_question(question_id)
+    if not question:
         raise HTTPException(404, "Question not found")
     
-    question = data["questions"][question_id]
-    
     # Get quiz
-    quiz = get_quiz(question["quiz_id"])
+    quiz = await aio.quiz.get_quiz(question["quiz_id"])
     if not quiz:
         raise HTTPException(404, "Quiz not found")
     
     # Check if teacher owns the class
-    cls = storage.get_class(int(quiz["class_id"]))
+    cls = await aio.storage.get_class(int(quiz["class_id"]))
     if not cls or cls["teacher_tg_id"] != user_id:
         raise HTTPException(403, "Not your class")
     
-    # Check if quiz is in draft status
-    if quiz["status"] != "draft":
-        raise HTTPException(400, "Cannot modify questions for a published quiz")
+    # Published quizzes only take answer-key fixes, which regrade the completed attempts
+    changes = request.model_dump(exclude_none=True)
+    if quiz["status"] != "draft" and set(changes) - {"correct_answer", "points"}:
+        raise HTTPException(400, "Only correct_answer and points can be changed on a published quiz")
     
     # Update question
-    updated_question = update_question(question_id, **request.model_dump(exclude_none=True))
+    updated_question = await aio.quiz.update_question(question_id, **changes)
     if not updated_question:
         raise HTTPException(404, "Question not found")
     
+    if quiz["status"] != "draft":
+        await aio.quiz_analytics.regrade_quiz(quiz["quiz_id"])
+    
     return updated_question
 
 @router.delete("/teacher/questions/{question_id}")
@@ -245,19 +273,17 @@ async def teacher_delete_question(
 ):
     """Delete a question"""
     # Get question
-    data = storage.load()
-    if "questions" not in data or question_id not in data["questions"]:
+    question = await aio.quiz.get_question(question_id)
+    if not question:
         raise HTTPException(404, "Question not found")
     
-    question = data["questions"][question_id]
-    
     # Get quiz
-    quiz = get_quiz(question["quiz_id"])
+    quiz = await aio.quiz.get_quiz(question["quiz_id"])
     if not quiz:
         raise HTTPException(404, "Quiz not found")
     
     # Check if teacher owns the class
-    cls = storage.get_class(int(quiz["class_id"]))
+    cls = await aio.storage.get_class(int(quiz["class_id"]))
     if not cls or cls["teacher_tg_id"] != user_id:
         raise HTTPException(403, "Not your class")
     
@@ -266,7 +292,7 @@ async def teacher_delete_question(
         raise HTTPException(400, "Cannot modify questions for a published quiz")
     
     # Delete question
-    success = delete_question(question_id)
+    success = await aio.quiz.delete_question(question_id)
     if not success:
         raise HTTPException(404, "Question not found")
     
@@ -279,22 +305,22 @@ async def student_list_quizzes(
 ):
     """List available quizzes for a student"""
     # Ensure student exists
-    storage.ensure_student(user_id)
+    await aio.storage.ensure_student(user_id)
     
     # Get student's courses
-    courses = storage.get_student_courses(user_id)
+    courses = await aio.storage.get_student_courses(user_id)
     
     # Get quizzes for each course
     result = []
     for course in courses:
-        quizzes = list_quizzes(course["course_id"])
+        quizzes = await aio.quiz.list_quizzes(course["course_id"])
         
         # Filter to only published quizzes
         quizzes = [q for q in quizzes if q["status"] == "published"]
         
         for quiz in quizzes:
             # Get student's attempts for this quiz
-            attempts = list_student_quiz_attempts(user_id, quiz["quiz_id"])
+            attempts = await aio.quiz.list_student_quiz_attempts(user_id, quiz["quiz_id"])
             
             # Calculate best score
             best_score = max([a["score"] for a in attempts if a["score"] is not None], default=None)
@@ -322,10 +348,10 @@ async def student_get_quiz(
 ):
     """Get a quiz for a student"""
     # Ensure student exists
-    storage.ensure_student(user_id)
+    await aio.storage.ensure_student(user_id)
     
     # Get quiz
-    quiz = get_quiz(quiz_id)
+    quiz = await aio.quiz.get_quiz(quiz_id)
     if not quiz:
         raise HTTPException(404, "Quiz not found")
     
@@ -334,14 +360,14 @@ async def student_get_quiz(
         raise HTTPException(404, "Quiz not found")
     
     # Check if student is enrolled in the course
-    if not storage.is_student_enrolled(user_id, quiz["class_id"]):
+    if not await aio.storage.is_student_enrolled(user_id, quiz["class_id"]):
         raise HTTPException(403, "You are not enrolled in this course")
     
     # Get course
-    course = storage.get_class(int(quiz["class_id"]))
+    course = await aio.storage.get_class(int(quiz["class_id"]))
     
     # Get student's attempts for this quiz
-    attempts = list_student_quiz_attempts(user_id, quiz_id)
+    attempts = await aio.quiz.list_student_quiz_attempts(user_id, quiz_id)
     
     # Calculate best score
     best_score = max([a["score"] for a in attempts if a["score"] is not None], default=None)
@@ -369,10 +395,10 @@ async def student_start_attempt(
 ):
     """Start a quiz attempt"""
     # Ensure student exists
-    storage.ensure_student(user_id)
+    await aio.storage.ensure_student(user_id)
     
     # Get quiz
-    quiz = get_quiz(request.quiz_id)
+    quiz = await aio.quiz.get_quiz(request.quiz_id)
     if not quiz:
         raise HTTPException(404, "Quiz not found")
     
@@ -381,19 +407,18 @@ async def student_start_attempt(
         raise HTTPException(400, "Quiz is not available")
     
     # Check if student is enrolled in the course
-    if not storage.is_student_enrolled(user_id, quiz["class_id"]):
+    if not await aio.storage.is_student_enrolled(user_id, quiz["class_id"]):
         raise HTTPException(403, "You are not enrolled in this course")
     
     try:
         # Start attempt
-        attempt = start_quiz_attempt(request.quiz_id, user_id)
+        attempt = await aio.quiz.start_quiz_attempt(request.quiz_id, user_id)
         
         # Get questions
-        questions = list_questions(request.quiz_id)
+        questions = await aio.quiz.list_questions(request.quiz_id)
         
         # Remove correct answers from questions
-        for q in questions:
-            q.pop("correct_answer", None)
+        questions = [{k: v for k, v in q.items() if k != "correct_answer"} for q in questions]
         
         return {
             "attempt": attempt,
@@ -410,7 +435,7 @@ async def student_answer_question(
 ):
     """Answer a question in a quiz attempt"""
     # Get attempt
-    attempt = get_quiz_attempt(attempt_id)
+    attempt = await aio.quiz.get_quiz_attempt(attempt_id)
     if not attempt:
         raise HTTPException(404, "Attempt not found")
     
@@ -420,11 +445,42 @@ async def student_answer_question(
     
     try:
         # Record answer
-        updated_attempt = answer_question(attempt_id, request.question_id, request.answer)
+        updated_attempt = await aio.quiz.answer_question(attempt_id, request.question_id, request.answer)
         return updated_attempt
     except ValueError as e:
         raise HTTPException(400, str(e))
 
+@router.post("/student/attempts/{attempt_id}/answers")
+async def student_answer_questions(
+    attempt_id: str,
+    request: BulkAnswerRequest,
+    user_id: int = Depends(current_user_id())
+):
+    """Answer several questions in one request, optionally completing the attempt"""
+    # Get attempt
+    attempt = await aio.quiz.get_quiz_attempt(attempt_id)
+    if not attempt:
+        raise HTTPException(404, "Attempt not found")
+    
+    # Check if this is the student's attempt
+    if attempt["student_tg_id"] != user_id:
+        raise HTTPException(403, "Not your attempt")
+    
+    answers = {a.question_id: a.answer for a in request.answers}
+    try:
+        if not request.complete:
+            return {"attempt": await aio.quiz.answer_questions(attempt_id, answers), "passed": None}
+        
+        # Record the answers and complete in one save
+        completed_attempt = await aio.quiz.complete_quiz_attempt(attempt_id, answers)
+        quiz = await aio.quiz.get_quiz(completed_attempt["quiz_id"])
+        passed = None
+        if quiz.get("passing_score") is not None:
+            passed = completed_attempt["score"] >= quiz["passing_score"]
+        return {"attempt": completed_attempt, "passed": passed}
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+
 @router.post("/student/attempts/{attempt_id}/complete")
 async def student_complete_attempt(
     attempt_id: str,
@@ -432,7 +488,7 @@ async def student_complete_attempt(
 ):
     """Complete a quiz attempt"""
     # Get attempt
-    attempt = get_quiz_attempt(attempt_id)
+    attempt = await aio.quiz.get_quiz_attempt(attempt_id)
     if not attempt:
         raise HTTPException(404, "Attempt not found")
     
@@ -442,10 +498,10 @@ async def student_complete_attempt(
     
     try:
         # Complete attempt
-        completed_attempt = complete_quiz_attempt(attempt_id)
+        completed_attempt = await aio.quiz.complete_quiz_attempt(attempt_id)
         
         # Get quiz
-        quiz = get_quiz(completed_attempt["quiz_id"])
+        quiz = await aio.quiz.get_quiz(completed_attempt["quiz_id"])
         
         # Check if passed
         passed = None
@@ -466,7 +522,7 @@ async def student_get_attempt(
 ):
     """Get a quiz attempt"""
     # Get attempt
-    attempt = get_quiz_attempt(attempt_id)
+    attempt = await aio.quiz.get_quiz_attempt(attempt_id)
     if not attempt:
         raise HTTPException(404, "Attempt not found")
     
@@ -475,10 +531,10 @@ async def student_get_attempt(
         raise HTTPException(403, "Not your attempt")
     
     # Get quiz
-    quiz = get_quiz(attempt["quiz_id"])
+    quiz = await aio.quiz.get_quiz(attempt["quiz_id"])
     
     # Get questions
-    questions = list_questions(attempt["quiz_id"])
+    questions = await aio.quiz.list_questions(attempt["quiz_id"])
     
     # If attempt is completed, include correct answers
     if attempt["status"] == "completed":
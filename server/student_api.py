@@ -1,10 +1,11 @@
 # server/student_api.py
-import os, uuid
+import uuid
 from typing import Optional, List
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, Request
 from pydantic import BaseModel
-from storage import storage
+from storage import aio
 from server.app import current_user_id
+from server import uploads
 
 router = APIRouter(prefix="/api/student", tags=["student"])
 
@@ -42,6 +43,17 @@ class SubmissionResponse(BaseModel):
     files: List[SubmissionFile] = []
     status: str
 
+class UploadCreateRequest(BaseModel):
+    filename: str
+    mime_type: Optional[str] = None
+    size: int
+
+class UploadStatusResponse(BaseModel):
+    upload_id: str
+    offset: int
+    size: int
+    chunk_size: int
+
 class AssignmentDetailResponse(BaseModel):
     id: str
     title: str
@@ -57,28 +69,21 @@ class AssignmentDetailResponse(BaseModel):
 async def get_courses(user_id: int = Depends(current_user_id())):
     """Get all courses the student is enrolled in"""
     # Ensure student exists
-    storage.ensure_student(user_id)
+    await aio.storage.ensure_student(user_id)
     
-    # Get student's courses
-    courses = storage.get_student_courses(user_id)
+    # Get student's courses with assignments and submission status in one read
+    courses = await aio.storage.get_student_dashboard(user_id)
     
     # Format response
     result = []
     for course in courses:
-        # Get assignments for this course
-        assignments = storage.list_course_assignments(course["course_id"])
-        # Count completed assignments
-        completed = 0
-        for assignment in assignments:
-            if storage.has_student_submitted(assignment["assignment_id"], user_id):
-                completed += 1
-                
+        assignments = course["assignments"]
         result.append({
             "id": course["course_id"],
             "title": course["title"],
             "teacher_name": course["teacher_name"],
             "assignment_count": len(assignments),
-            "completed_count": completed
+            "completed_count": sum(1 for a in assignments if a["submitted"])
         })
     
     return result
@@ -87,15 +92,15 @@ async def get_courses(user_id: int = Depends(current_user_id())):
 async def enroll_in_course(request: EnrollRequest, user_id: int = Depends(current_user_id())):
     """Enroll student in a course using a course code"""
     # Ensure student exists
-    storage.ensure_student(user_id)
+    await aio.storage.ensure_student(user_id)
     
     # Find course by code
-    course = storage.get_course_by_code(request.course_code)
+    course = await aio.storage.get_course_by_code(request.course_code)
     if not course:
         raise HTTPException(404, "Course not found with this code")
     
     # Enroll student
-    storage.enroll_student(user_id, course["course_id"])
+    await aio.storage.enroll_student(user_id, course["course_id"])
     
     return {"success": True, "course_id": course["course_id"]}
 
@@ -103,19 +108,15 @@ async def enroll_in_course(request: EnrollRequest, user_id: int = Depends(curren
 async def get_assignments(user_id: int = Depends(current_user_id())):
     """Get all assignments for courses the student is enrolled in"""
     # Ensure student exists
-    storage.ensure_student(user_id)
+    await aio.storage.ensure_student(user_id)
     
-    # Get student's courses
-    courses = storage.get_student_courses(user_id)
+    # Get student's courses with assignments and submission status in one read
+    courses = await aio.storage.get_student_dashboard(user_id)
     
     # Get assignments for all courses
     result = []
     for course in courses:
-        assignments = storage.list_course_assignments(course["course_id"])
-        for assignment in assignments:
-            # Check if student has submitted
-            submitted = storage.has_student_submitted(assignment["assignment_id"], user_id)
-            
+        for assignment in course["assignments"]:
             result.append({
                 "id": assignment["assignment_id"],
                 "title": assignment["title"],
@@ -124,7 +125,7 @@ async def get_assignments(user_id: int = Depends(current_user_id())):
                 "course_title": course["title"],
                 "due_at": assignment.get("due_at"),
                 "closed": assignment.get("status") == "closed",
-                "submitted": submitted
+                "submitted": assignment["submitted"]
             })
     
     return result
@@ -133,24 +134,24 @@ async def get_assignments(user_id: int = Depends(current_user_id())):
 async def get_assignment_detail(assignment_id: str, user_id: int = Depends(current_user_id())):
     """Get detailed information about an assignment"""
     # Ensure student exists
-    storage.ensure_student(user_id)
+    await aio.storage.ensure_student(user_id)
     
     # Get assignment
-    assignment = storage.get_assignment(assignment_id)
+    assignment = await aio.storage.get_assignment(assignment_id)
     if not assignment:
         raise HTTPException(404, "Assignment not found")
     
     # Get course
-    course = storage.get_class(int(assignment["class_id"]))
+    course = await aio.storage.get_class(int(assignment["class_id"]))
     if not course:
         raise HTTPException(404, "Course not found")
     
     # Check if student is enrolled in this course
-    if not storage.is_student_enrolled(user_id, assignment["class_id"]):
+    if not await aio.storage.is_student_enrolled(user_id, assignment["class_id"]):
         raise HTTPException(403, "You are not enrolled in this course")
     
     # Check if student has submitted
-    submission = storage.get_student_submission(assignment_id, user_id)
+    submission = await aio.storage.get_student_submission(assignment_id, user_id)
     submission_response = None
     
     if submission:
@@ -158,7 +159,7 @@ async def get_assignment_detail(assignment_id: str, user_id: int = Depends(curre
         if submission.get("file"):
             file_meta = submission["file"]
             files.append({
-                "name": file_meta.get("filename", "file"),
+                "name": file_meta.get("filename") or "file",
                 "url": f"/api/files/{file_meta.get('file_id')}",
                 "mime_type": file_meta.get("mime", "application/octet-stream"),
                 "size": file_meta.get("size", 0)
@@ -188,14 +189,15 @@ async def submit_assignment(
     assignment_id: str,
     text: str = Form(""),
     file: Optional[UploadFile] = File(None),
+    upload_id: Optional[str] = Form(None),
     user_id: int = Depends(current_user_id())
 ):
     """Submit an assignment"""
     # Ensure student exists
-    storage.ensure_student(user_id)
+    await aio.storage.ensure_student(user_id)
     
     # Get assignment
-    assignment = storage.get_assignment(assignment_id)
+    assignment = await aio.storage.get_assignment(assignment_id)
     if not assignment:
         raise HTTPException(404, "Assignment not found")
     
@@ -204,45 +206,26 @@ async def submit_assignment(
         raise HTTPException(400, "Assignment is closed")
     
     # Check if student is enrolled in this course
-    if not storage.is_student_enrolled(user_id, assignment["class_id"]):
+    if not await aio.storage.is_student_enrolled(user_id, assignment["class_id"]):
         raise HTTPException(403, "You are not enrolled in this course")
     
-    # Process file if provided
+    # Process file if provided (streamed directly, or assembled by an upload session)
     file_meta = None
-    if file:
-        # Get student name for filename
-        student = storage.get_student(user_id)
-        student_name = student.get("name", f"student_{user_id}")
-        
-        # Create safe filename
-        file_id = str(uuid.uuid4())
-        filename = f"{file_id}_{student_name}_{file.filename}"
-        
-        # Ensure files directory exists
-        files_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "files")
-        os.makedirs(files_dir, exist_ok=True)
+    if file or upload_id:
+        if upload_id:
+            stored = await aio.run(uploads.complete_session, upload_id, user_id)
+        else:
+            stored = await uploads.save_upload(file)
         
-        # Save file
-        file_path = os.path.join(files_dir, filename)
-        with open(file_path, "wb") as f:
-            content = await file.read()
-            f.write(content)
-        
-        # Create file metadata
-        file_meta = {
-            "file_id": file_id,
-            "filename": file.filename,
-            "mime": file.content_type,
-            "size": os.path.getsize(file_path),
-            "local_path": file_path
-        }
+        # Create file metadata (the bytes live in the blob store under stored["sha256"])
+        file_meta = {"file_id": str(uuid.uuid4()), **stored}
     
     # Get student name
-    student = storage.get_student(user_id)
+    student = await aio.storage.get_student(user_id)
     student_name = student.get("name", f"User {user_id}")
     
     # Add submission
-    submission = storage.add_submission(
+    submission = await aio.storage.add_submission(
         assignment_id,
         user_id,
         student_name,
@@ -251,9 +234,34 @@ async def submit_assignment(
     )
     
     # Notify teacher
-    cls = storage.get_class(int(assignment["class_id"]))
+    cls = await aio.storage.get_class(int(assignment["class_id"]))
     if cls:
-        from server.telegram_api import send_teacher_snapshot
-        send_teacher_snapshot(cls["teacher_tg_id"])
+        await aio.outbox.request_snapshot(cls["teacher_tg_id"])
     
     return {"success": True, "submission_id": submission["submission_id"]}
+
+# --- Resumable uploads ---
+@router.post("/uploads", response_model=UploadStatusResponse)
+async def create_upload(request: UploadCreateRequest, user_id: int = Depends(current_user_id())):
+    """Start an upload session; send the bytes with PUT, then submit with its upload_id"""
+    session = await aio.run(uploads.create_session, user_id, request.filename, request.mime_type, request.size)
+    return {"upload_id": session["upload_id"], "offset": 0, "size": session["size"],
+            "chunk_size": uploads.CHUNK_SIZE}
+
+@router.get("/uploads/{upload_id}", response_model=UploadStatusResponse)
+async def get_upload(upload_id: str, user_id: int = Depends(current_user_id())):
+    """How many bytes the server holds, i.e. where to resume"""
+    session = await aio.run(uploads.get_session, upload_id, user_id)
+    return {"upload_id": session["upload_id"], "offset": session["offset"], "size": session["size"],
+            "chunk_size": uploads.CHUNK_SIZE}
+
+@router.put("/uploads/{upload_id}", response_model=UploadStatusResponse)
+async def put_upload_chunk(upload_id: str, request: Request, user_id: int = Depends(current_user_id())):
+    """Append the request body at the offset given in the Upload-Offset header"""
+    try:
+        offset = int(request.headers.get("upload-offset", "0"))
+    except ValueError:
+        raise HTTPException(400, "Invalid Upload-Offset header")
+    session = await uploads.append_chunk(upload_id, user_id, offset, request.stream())
+    return {"upload_id": session["upload_id"], "offset": session["offset"], "size": session["size"],
+            "chunk_size": uploads.CHUNK_SIZE}
@@ -1,58 +1,138 @@
 # server/telegram_api.py
-import os, requests
-from typing import Optional
+"""
+Async client for the Telegram Bot API.
+
+Calls share one keep-alive connection pool per event loop, are spaced to stay under
+Telegram's flood limits (globally and per chat), and are retried after the delay a
+429 response asks for. Endpoints schedule these coroutines as background tasks (or
+queue them in the outbox, see server/outbox.py) so a request never waits on Telegram.
+"""
+import os, time, asyncio, weakref
+from typing import Optional, Dict, Any, AsyncIterator
+import httpx
+from storage import aio
 from storage.storage import build_snapshot_text
 
 BOT_TOKEN = os.environ.get("NOETICA_BOT_TOKEN") or ""
 API_BASE = f"https://api.telegram.org/bot{BOT_TOKEN}"
+FILE_BASE = f"https://api.telegram.org/file/bot{BOT_TOKEN}"
+MAX_RETRIES = 3
+GLOBAL_INTERVAL = 1 / 30   # ~30 messages per second overall
+CHAT_INTERVAL = 1.0        # ~1 message per second in a private chat
+GROUP_INTERVAL = 3.0       # ~20 messages per minute in a group
+
+class _RateLimiter:
+    """Hands out send slots at least `interval` apart per key; a 429 pushes a key's next slot back."""
+    def __init__(self):
+        self._next: Dict[Any, float] = {}
+
+    async def wait(self, key, interval: float):
+        now = time.monotonic()
+        at = max(now, self._next.get(key, 0.0))
+        self._next[key] = at + interval   # reserved before sleeping, so concurrent callers queue up
+        if len(self._next) > 10000:
+            self._next = {k: t for k, t in self._next.items() if t > now}
+        if at > now:
+            await asyncio.sleep(at - now)
+
+    def block(self, key, seconds: float):
+        self._next[key] = max(self._next.get(key, 0.0), time.monotonic() + seconds)
+
+_limiter = _RateLimiter()
+# httpx pools are bound to the loop they were opened on (the API and the bot each run their own)
+_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = weakref.WeakKeyDictionary()
+
+def _client() -> httpx.AsyncClient:
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None or client.is_closed:
+        client = _clients[loop] = httpx.AsyncClient(
+            timeout=httpx.Timeout(20.0, connect=5.0),
+            limits=httpx.Limits(max_connections=20, max_keepalive_connections=10, keepalive_expiry=60),
+        )
+    return client
 
-def _post(method: str, **payload):
+async def aclose():
+    """Close this event loop's connection pool (call on shutdown)."""
+    client = _clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+
+async def _post(method: str, **payload):
     url = f"{API_BASE}/{method}"
-    r = requests.post(url, json=payload, timeout=20)
-    r.raise_for_status()
-    data = r.json()
-    if not data.get("ok"):
-        raise RuntimeError(f"Telegram API error: {data}")
-    return data["result"]
+    payload = {k: v for k, v in payload.items() if v is not None}
+    chat_id = payload.get("chat_id")
+    for attempt in range(MAX_RETRIES + 1):
+        await _limiter.wait(None, GLOBAL_INTERVAL)
+        if chat_id is not None:
+            await _limiter.wait(chat_id, GROUP_INTERVAL if str(chat_id).startswith("-") else CHAT_INTERVAL)
+        r = await _client().post(url, json=payload)
+        if r.status_code == 429 and attempt < MAX_RETRIES:
+            retry_after = r.json().get("parameters", {}).get("retry_after", 1)
+            _limiter.block(chat_id, retry_after)
+            continue
+        try:
+            data = r.json()   # error replies carry a JSON description too
+        except ValueError:
+            r.raise_for_status()
+            raise
+        if not data.get("ok"):
+            raise RuntimeError(f"Telegram API error: {data}")
+        return data["result"]
 
-def send_message(chat_id: int, text: str, parse_mode: Optional[str] = None, reply_markup: Optional[dict]=None):
-    return _post("sendMessage", chat_id=chat_id, text=text, parse_mode=parse_mode, reply_markup=reply_markup)
+async def send_message(chat_id: int, text: str, parse_mode: Optional[str] = None, reply_markup: Optional[dict]=None):
+    return await _post("sendMessage", chat_id=chat_id, text=text, parse_mode=parse_mode, reply_markup=reply_markup)
 
-def pin_message(chat_id: int, message_id: int, silent: bool=True):
+async def pin_message(chat_id: int, message_id: int, silent: bool=True):
     try:
-        return _post("pinChatMessage", chat_id=chat_id, message_id=message_id, disable_notification=silent)
+        return await _post("pinChatMessage", chat_id=chat_id, message_id=message_id, disable_notification=silent)
     except Exception:
         return None
 
-def edit_message_text(chat_id: int, message_id: int, text: str, parse_mode: Optional[str]=None, reply_markup: Optional[dict]=None):
-    return _post("editMessageText", chat_id=chat_id, message_id=message_id, text=text, parse_mode=parse_mode, reply_markup=reply_markup)
+async def edit_message_text(chat_id: int, message_id: int, text: str, parse_mode: Optional[str]=None, reply_markup: Optional[dict]=None):
+    return await _post("editMessageText", chat_id=chat_id, message_id=message_id, text=text, parse_mode=parse_mode, reply_markup=reply_markup)
 
-def post_assignment_to_group(group_chat_id: int, assignment_id: str, title: str, due_at: Optional[str], instructions_md: str):
+async def post_assignment_to_group(group_chat_id: int, assignment_id: str, title: str, due_at: Optional[str], instructions_md: str):
     lines = [f"📌 *Assignment* — *{assignment_id}*", f"*{title}*"]
     if due_at: lines.append(f"🗓 Due: {due_at}")
     if instructions_md: lines.append(f"\n{instructions_md}")
     lines.append(f"\nReply to *this message* with your document/file.")
     text = "\n".join(lines)
-    res = send_message(group_chat_id, text, parse_mode="Markdown", reply_markup={
+    res = await send_message(group_chat_id, text, parse_mode="Markdown", reply_markup={
         "inline_keyboard":[
             [{"text":"View details","callback_data":f"view:{assignment_id}"}],
         ]
     })
-    pin_message(group_chat_id, res["message_id"])
+    await pin_message(group_chat_id, res["message_id"])
     return res["message_id"]
 
-def send_teacher_snapshot(teacher_tg_id: int):
-    text = build_snapshot_text()
-    try:
-        m = send_message(teacher_tg_id, text)
+async def send_teacher_snapshot(teacher_tg_id: int, message_id: Optional[int] = None) -> int:
+    """Edit the teacher's pinned snapshot, or send and pin a new one; returns its message id."""
+    text = await aio.run(build_snapshot_text, teacher_tg_id)
+    if message_id:
         try:
-            pin_message(teacher_tg_id, m["message_id"])
-        except Exception:
-            pass
-    except Exception as e:
-        print("Snapshot send failed:", e)
+            await edit_message_text(teacher_tg_id, message_id, text)
+            return message_id
+        except RuntimeError as e:
+            if "message is not modified" in str(e):
+                return message_id
+            # deleted or too old to edit: fall through and post a fresh one
+    m = await send_message(teacher_tg_id, text)
+    await pin_message(teacher_tg_id, m["message_id"])
+    return m["message_id"]
 
-def send_reminder(group_chat_id: int, assignment_id: str, title: str, due_at: Optional[str]):
+async def send_reminder(group_chat_id: int, assignment_id: str, title: str, due_at: Optional[str]):
     text = f"⏰ Reminder: *{title}* (ID: {assignment_id})"
     if due_at: text += f"\nDue: {due_at}"
-    return send_message(group_chat_id, text, parse_mode="Markdown")
\ No newline at end of file
+    return await send_message(group_chat_id, text, parse_mode="Markdown")
+
+async def get_file(file_id: str) -> Dict[str, Any]:
+    """Resolve a file_id to its download path (valid for at least an hour) and size."""
+    return await _post("getFile", file_id=file_id)
+
+async def download_file(file_path: str, chunk_size: int = 1024 * 1024) -> AsyncIterator[bytes]:
+    """Stream a file resolved by get_file() in chunks."""
+    async with _client().stream("GET", f"{FILE_BASE}/{file_path}") as r:
+        r.raise_for_status()
+        async for chunk in r.aiter_bytes(chunk_size):
+            yield chunk
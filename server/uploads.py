@@ -0,0 +1,150 @@
+# server/uploads.py
+"""
+Streaming storage of uploaded submission files.
+
+Uploads are copied to disk in fixed-size chunks, hashed (SHA-256) while being written,
+capped at NOETICA_MAX_UPLOAD_MB and renamed atomically into the content-addressed blob
+store (storage/blobs.py), so identical files are kept once. Upload sessions
+let the Mini App send a large file in pieces and resume after a dropped connection.
+"""
+import os, json, uuid, time, hashlib, asyncio, tempfile
+from typing import Dict, Any, AsyncIterator
+from fastapi import HTTPException, UploadFile
+from starlette.concurrency import run_in_threadpool
+from storage.storage import DATA_DIR, FILES_DIR, _now_iso
+from storage import blobs
+
+UPLOADS_DIR = os.path.join(DATA_DIR, "uploads")
+os.makedirs(UPLOADS_DIR, exist_ok=True)
+CHUNK_SIZE = 1024 * 1024
+MAX_UPLOAD_BYTES = int(float(os.environ.get("NOETICA_MAX_UPLOAD_MB") or 100) * 1024 * 1024)
+SESSION_TTL_SECONDS = 24 * 3600
+
+# upload_id -> (bytes hashed so far, running hash); lost on restart, then rebuilt from the part file
+_hashers: Dict[str, tuple] = {}
+_session_locks: Dict[str, asyncio.Lock] = {}
+
+def _check_size(size: int):
+    if size > MAX_UPLOAD_BYTES:
+        raise HTTPException(413, f"File exceeds the {MAX_UPLOAD_BYTES // (1024 * 1024)} MB upload limit")
+
+def _safe_name(filename: str) -> str:
+    return os.path.basename(filename or "") or "file"
+
+async def save_upload(file: UploadFile) -> Dict[str, Any]:
+    """Stream a multipart upload into the blob store; returns its file metadata."""
+    filename = _safe_name(file.filename)
+    hasher, size = hashlib.sha256(), 0
+    fd, tmp_path = tempfile.mkstemp(prefix=".upload_", dir=FILES_DIR)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            while True:
+                chunk = await file.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                _check_size(size)
+                hasher.update(chunk)
+                await run_in_threadpool(f.write, chunk)
+            await run_in_threadpool(os.fsync, f.fileno())
+        path = blobs.put(tmp_path, hasher.hexdigest())
+    except BaseException:
+        try: os.remove(tmp_path)
+        except FileNotFoundError: pass
+        raise
+    return {"filename": filename, "mime": file.content_type or "application/octet-stream",
+            "size": size, "local_path": path, "sha256": hasher.hexdigest()}
+
+# --- RESUMABLE SESSIONS ---
+def _meta_path(upload_id: str) -> str:
+    return os.path.join(UPLOADS_DIR, f"{upload_id}.json")
+
+def _part_path(upload_id: str) -> str:
+    return os.path.join(UPLOADS_DIR, f"{upload_id}.part")
+
+def _expire_sessions():
+    cutoff = time.time() - SESSION_TTL_SECONDS
+    for name in os.listdir(UPLOADS_DIR):
+        path = os.path.join(UPLOADS_DIR, name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+                _hashers.pop(name.rsplit(".", 1)[0], None)
+        except FileNotFoundError:
+            pass
+
+def create_session(user_id: int, filename: str, mime: str, size: int) -> Dict[str, Any]:
+    _check_size(size)
+    _expire_sessions()
+    session = {"upload_id": uuid.uuid4().hex, "user_id": user_id, "filename": _safe_name(filename),
+               "mime": mime or "application/octet-stream", "size": size, "created_at": _now_iso()}
+    with open(_meta_path(session["upload_id"]), "w", encoding="utf-8") as f:
+        json.dump(session, f)
+    open(_part_path(session["upload_id"]), "wb").close()
+    return session
+
+def get_session(upload_id: str, user_id: int) -> Dict[str, Any]:
+    try:
+        with open(_meta_path(os.path.basename(upload_id)), "r", encoding="utf-8") as f:
+            session = json.load(f)
+    except FileNotFoundError:
+        raise HTTPException(404, "Upload session not found")
+    if session["user_id"] != user_id:
+        raise HTTPException(403, "Not your upload")
+    session["offset"] = os.path.getsize(_part_path(session["upload_id"]))
+    return session
+
+async def append_chunk(upload_id: str, user_id: int, offset: int, body: AsyncIterator[bytes]) -> Dict[str, Any]:
+    """Append request body bytes at `offset`, which must equal what the server already holds."""
+    upload_id = os.path.basename(upload_id)
+    lock = _session_locks.setdefault(upload_id, asyncio.Lock())
+    async with lock:
+        session = get_session(upload_id, user_id)
+        if offset != session["offset"]:
+            raise HTTPException(409, f"Upload offset mismatch; resume from {session['offset']}")
+        entry = _hashers.get(upload_id)
+        if offset == 0:
+            hasher = hashlib.sha256()
+        elif entry and entry[0] == offset:
+            # a copy: the cached state must stay at `offset` if this chunk is rejected
+            hasher = entry[1].copy()
+        else:
+            hasher = None  # rebuilt from the part file when the upload completes
+        size = offset
+        with open(_part_path(upload_id), "ab") as f:
+            async for chunk in body:
+                if not chunk:
+                    continue
+                size += len(chunk)
+                if size > session["size"]:
+                    f.truncate(offset)
+                    raise HTTPException(413, "Chunk goes past the declared file size")
+                if hasher is not None:
+                    hasher.update(chunk)
+                await run_in_threadpool(f.write, chunk)
+        if hasher is not None:
+            _hashers[upload_id] = (size, hasher)
+        else:
+            _hashers.pop(upload_id, None)
+        session["offset"] = size
+        return session
+
+def complete_session(upload_id: str, user_id: int) -> Dict[str, Any]:
+    """Move a fully received upload into the blob store; returns its file metadata."""
+    session = get_session(upload_id, user_id)
+    if session["offset"] != session["size"]:
+        raise HTTPException(400, f"Upload incomplete: {session['offset']} of {session['size']} bytes received")
+    part = _part_path(session["upload_id"])
+    received, hasher = _hashers.pop(session["upload_id"], (0, None))
+    if hasher is None or received != session["size"]:
+        hasher = hashlib.sha256()
+        with open(part, "rb") as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                hasher.update(chunk)
+    with open(part, "rb+") as f:
+        os.fsync(f.fileno())
+    path = blobs.put(part, hasher.hexdigest())
+    os.remove(_meta_path(session["upload_id"]))
+    _session_locks.pop(session["upload_id"], None)
+    return {"filename": session["filename"], "mime": session["mime"], "size": session["size"],
+            "local_path": path, "sha256": hasher.hexdigest()}
@@ -7,15 +7,20 @@ Uses a file-based JSON database with atomic writes for data integrity.
 Modules:
     storage.py - Core storage operations (classes, assignments, submissions)
     quiz.py - Quiz-related storage operations
+    outbox.py - Durable queue of pending Telegram notifications
+    aio.py - Async facade running storage calls on a bounded thread pool
 """
 
 from .storage import (
     # Core functions
     load,
     save,
+    lock_stats,
+    read_events,
     
     # Teachers
     ensure_teacher,
+    get_teacher,
     
     # Students
     ensure_student,
@@ -30,11 +35,13 @@ from .storage import (
     enroll_student,
     is_student_enrolled,
     get_student_courses,
+    get_student_dashboard,
     
     # Assignments
     create_assignment,
     set_assignment_message_id,
     list_assignments,
+    find_assignment_by_message,
     list_course_assignments,
     get_assignment,
     update_assignment,
@@ -44,7 +51,11 @@ from .storage import (
     list_submissions,
     has_student_submitted,
     get_student_submission,
-    export_submissions_csv,
+    get_file_meta,
+    update_file_meta,
+    iter_submissions_csv,
+    iter_gradebook_csv,
+    get_gradebook,
     
     # Utilities
     build_snapshot_text,
@@ -64,9 +75,12 @@ class Storage:
         # Import all functions as methods
         self.load = load
         self.save = save
+        self.lock_stats = lock_stats
+        self.read_events = read_events
         
         # Teachers
         self.ensure_teacher = ensure_teacher
+        self.get_teacher = get_teacher
         
         # Students
         self.ensure_student = ensure_student
@@ -81,11 +95,13 @@ class Storage:
         self.enroll_student = enroll_student
         self.is_student_enrolled = is_student_enrolled
         self.get_student_courses = get_student_courses
+        self.get_student_dashboard = get_student_dashboard
         
         # Assignments
         self.create_assignment = create_assignment
         self.set_assignment_message_id = set_assignment_message_id
         self.list_assignments = list_assignments
+        self.find_assignment_by_message = find_assignment_by_message
         self.list_course_assignments = list_course_assignments
         self.get_assignment = get_assignment
         self.update_assignment = update_assignment
@@ -95,7 +111,11 @@ class Storage:
         self.list_submissions = list_submissions
         self.has_student_submitted = has_student_submitted
         self.get_student_submission = get_student_submission
-        self.export_submissions_csv = export_submissions_csv
+        self.get_file_meta = get_file_meta
+        self.update_file_meta = update_file_meta
+        self.iter_submissions_csv = iter_submissions_csv
+        self.iter_gradebook_csv = iter_gradebook_csv
+        self.get_gradebook = get_gradebook
         
         # Utilities
         self.build_snapshot_text = build_snapshot_text
@@ -109,7 +129,10 @@ __all__ = [
     # Export individual functions too
     'load',
     'save',
+    'lock_stats',
+    'read_events',
     'ensure_teacher',
+    'get_teacher',
     'ensure_student',
     'get_student',
     'link_class',
@@ -118,9 +141,11 @@ __all__ = [
     'enroll_student',
     'is_student_enrolled',
     'get_student_courses',
+    'get_student_dashboard',
     'create_assignment',
     'set_assignment_message_id',
     'list_assignments',
+    'find_assignment_by_message',
     'list_course_assignments',
     'get_assignment',
     'update_assignment',
@@ -128,7 +153,11 @@ __all__ = [
     'list_submissions',
     'has_student_submitted',
     'get_student_submission',
-    'export_submissions_csv',
+    'get_file_meta',
+    'update_file_meta',
+    'iter_submissions_csv',
+    'iter_gradebook_csv',
+    'get_gradebook',
     'build_snapshot_text',
 ]
 
@@ -0,0 +1,67 @@
+# storage/aio.py
+"""
+Async facade over the storage API for async route handlers.
+
+Storage calls read and fsync files, so awaiting them directly on the event loop would
+stall every other request. The facade runs each call on a bounded thread pool
+(NOETICA_STORAGE_THREADS, default 8) instead:
+
+    from storage import aio
+    cls = await aio.storage.get_class(class_id)
+    quiz = await aio.quiz.get_quiz(quiz_id)
+    meta = await aio.run(uploads.complete_session, upload_id, user_id)
+"""
+from __future__ import annotations
+import asyncio, contextvars, functools, os, threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict
+from storage import storage as _storage, quiz as _quiz, quiz_analytics as _quiz_analytics, outbox as _outbox
+
+STORAGE_THREADS = int(os.environ.get("NOETICA_STORAGE_THREADS") or 8)
+_executor = ThreadPoolExecutor(max_workers=STORAGE_THREADS, thread_name_prefix="storage")
+_stats_lock = threading.Lock()
+_stats = {"calls": 0, "in_flight": 0, "max_in_flight": 0}
+
+def _finished(_future):
+    # Runs once the call returns, raises, or is cancelled while still queued.
+    with _stats_lock:
+        _stats["in_flight"] -= 1
+
+async def run(fn: Callable, *args, **kwargs) -> Any:
+    """Run a blocking function on the storage pool and await its result."""
+    ctx = contextvars.copy_context()
+    future = _executor.submit(functools.partial(ctx.run, fn, *args, **kwargs))
+    with _stats_lock:
+        _stats["calls"] += 1
+        _stats["in_flight"] += 1   # queued or running
+        _stats["max_in_flight"] = max(_stats["max_in_flight"], _stats["in_flight"])
+    future.add_done_callback(_finished)
+    return await asyncio.wrap_future(future)
+
+class AsyncFacade:
+    """Wraps a module or object so that calling any of its functions returns an awaitable."""
+    def __init__(self, target: Any):
+        self._target = target
+
+    def __getattr__(self, name: str):
+        fn = getattr(self._target, name)
+        if not callable(fn):
+            return fn
+        @functools.wraps(fn)
+        async def call(*args, **kwargs):
+            return await run(fn, *args, **kwargs)
+        setattr(self, name, call)
+        return call
+
+storage = AsyncFacade(_storage)
+quiz = AsyncFacade(_quiz)
+quiz_analytics = AsyncFacade(_quiz_analytics)
+outbox = AsyncFacade(_outbox)
+
+def pool_stats() -> Dict[str, Any]:
+    """Size and load of the storage thread pool."""
+    with _stats_lock:
+        return {"threads": STORAGE_THREADS, **_stats}
+
+def shutdown():
+    _executor.shutdown(wait=True)
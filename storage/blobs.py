@@ -0,0 +1,97 @@
+# storage/blobs.py
+"""
+Content-addressed store for submitted files.
+
+Each distinct file is kept once under data/files/blobs/<aa>/<bb>/<sha256>, however many
+submissions carry it. A blob's references are the entries of the 'files' index whose
+sha256 matches; blobs without any are removed by:
+    python -m storage.blobs gc [--dry-run]
+Files stored before the blob store existed are moved into it with:
+    python -m storage.blobs migrate
+"""
+from __future__ import annotations
+import os, sys, time, hashlib
+from collections import Counter
+from typing import Dict, Any
+from storage.storage import FILES_DIR, _all, update_file_meta
+
+BLOBS_DIR = os.path.join(FILES_DIR, "blobs")
+# A blob younger than this may belong to a submission that is still being saved.
+GC_GRACE_SECONDS = 3600
+
+def blob_path(digest: str) -> str:
+    return os.path.join(BLOBS_DIR, digest[:2], digest[2:4], digest)
+
+def put(tmp_path: str, digest: str) -> str:
+    """Move a fully written temp file into the store under its SHA-256; returns the blob path."""
+    path = blob_path(digest)
+    if os.path.exists(path):
+        os.remove(tmp_path)
+        os.utime(path)  # keep a freshly re-referenced blob out of the GC grace window
+    else:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(tmp_path, path)
+    return path
+
+def file_digest(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def refcounts() -> Counter:
+    """sha256 -> number of submitted files referring to it."""
+    return Counter(f["sha256"] for f in _all("files") if f.get("sha256"))
+
+def gc(dry_run: bool = False) -> Dict[str, Any]:
+    """Delete blobs and abandoned upload temp files that nothing refers to."""
+    refs = refcounts()
+    cutoff = time.time() - GC_GRACE_SECONDS
+    removed, freed = 0, 0
+    candidates = []
+    for root, _, names in os.walk(BLOBS_DIR):
+        candidates += [os.path.join(root, n) for n in names if n not in refs]
+    candidates += [os.path.join(FILES_DIR, n) for n in os.listdir(FILES_DIR) if n.startswith(".upload_")]
+    for path in candidates:
+        try:
+            st = os.stat(path)
+            if st.st_mtime >= cutoff:
+                continue
+            if not dry_run:
+                os.remove(path)
+        except FileNotFoundError:
+            continue
+        removed += 1
+        freed += st.st_size
+    return {"referenced": len(refs), "removed": removed, "bytes_freed": freed, "dry_run": dry_run}
+
+def migrate() -> Dict[str, Any]:
+    """Move files stored outside the blob store into it and record their digests."""
+    moved, missing = 0, 0
+    for meta in _all("files"):
+        src = meta.get("local_path")
+        if not src or src.startswith(BLOBS_DIR + os.sep):
+            continue
+        if not os.path.exists(src):
+            missing += 1
+            continue
+        digest = meta.get("sha256") or file_digest(src)
+        path = blob_path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.link(src, path)
+        # Link, repoint, then unlink: a crash in between never leaves a dangling path.
+        update_file_meta(meta["file_id"], local_path=path, sha256=digest)
+        os.remove(src)
+        moved += 1
+    return {"moved": moved, "missing": missing}
+
+if __name__ == "__main__":
+    cmd = sys.argv[1] if len(sys.argv) > 1 else ""
+    if cmd == "gc":
+        print(gc(dry_run="--dry-run" in sys.argv[2:]))
+    elif cmd == "migrate":
+        print(migrate())
+    else:
+        raise SystemExit("usage: python -m storage.blobs gc [--dry-run] | migrate")
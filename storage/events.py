@@ -0,0 +1,129 @@
+# storage/events.py
+"""
+Segmented, append-only event log (data/events/).
+
+Events produced by save() mutations are appended as JSON lines to the active segment,
+named <seq>-<YYYYMMDD>.jsonl. A new segment starts each UTC day or once the active one
+reaches NOETICA_EVENTS_SEGMENT_MB; the finished segment is gzip-compressed unless
+NOETICA_EVENTS_COMPRESS=false, and only the newest NOETICA_EVENTS_KEEP_SEGMENTS are
+kept (0 keeps everything). Appends are flushed to the OS but not fsynced.
+
+Consumers tail the log with read(cursor), which returns a batch of events and the
+cursor ("<seq>:<offset>") to pass next time.
+"""
+from __future__ import annotations
+import gzip, json, os, shutil, threading
+from datetime import datetime, timezone
+from typing import Dict, Any, List, Optional, Tuple
+from storage.locking import FileLock
+
+class EventLog:
+    def __init__(self, directory: str, segment_bytes: int = 8 * 1024 * 1024,
+                 compress: bool = True, keep_segments: int = 0):
+        self.dir = directory
+        self.segment_bytes = segment_bytes
+        self.compress = compress
+        self.keep_segments = keep_segments
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._flock = FileLock(os.path.join(directory, ".lock"))
+
+    def _segments(self) -> List[Tuple[int, str]]:
+        """(seq, path) of every segment, oldest first."""
+        out = []
+        for name in os.listdir(self.dir):
+            if name.endswith((".jsonl", ".jsonl.gz")) and name[:6].isdigit():
+                out.append((int(name[:6]), os.path.join(self.dir, name)))
+        return sorted(out)
+
+    def _active(self) -> str:
+        """Path of the segment to append to, rotating first if it is full or from another day."""
+        today = datetime.now(timezone.utc).strftime("%Y%m%d")
+        segments = self._segments()
+        if segments:
+            seq, path = segments[-1]
+            if (path.endswith(".jsonl") and os.path.basename(path)[7:15] == today
+                    and os.path.getsize(path) < self.segment_bytes):
+                return path
+            if path.endswith(".jsonl"):
+                self._seal(path)
+        else:
+            seq = 0
+        path = os.path.join(self.dir, f"{seq + 1:06d}-{today}.jsonl")
+        open(path, "ab").close()
+        if self.keep_segments:
+            for _, old in self._segments()[:-self.keep_segments]:
+                os.remove(old)
+        return path
+
+    def _seal(self, path: str):
+        """Finish a segment: no more appends go to it. Caller holds the locks."""
+        # A torn last line would otherwise stay in the sealed segment for good.
+        with open(path, "rb+") as f:
+            self._trim_torn_tail(f)
+        if not self.compress:
+            return
+        tmp = path + ".gz.tmp"
+        with open(path, "rb") as src, gzip.open(tmp, "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        os.replace(tmp, path + ".gz")
+        os.remove(path)
+
+    @staticmethod
+    def _trim_torn_tail(f):
+        """Drop a partial last line left by a writer that crashed mid-append."""
+        end = f.seek(0, os.SEEK_END)
+        if end == 0:
+            return
+        f.seek(end - 1)
+        if f.read(1) == b"\n":
+            return
+        pos = end
+        while pos > 0:
+            step = min(4096, pos)
+            f.seek(pos - step)
+            nl = f.read(step).rfind(b"\n")
+            if nl >= 0:
+                f.truncate(pos - step + nl + 1)
+                return
+            pos -= step
+        f.truncate(0)
+
+    def append(self, events: List[Dict[str, Any]]):
+        if not events:
+            return
+        data = "".join(json.dumps(e, ensure_ascii=False, separators=(",", ":")) + "\n" for e in events).encode("utf-8")
+        with self._lock, self._flock:
+            with open(self._active(), "rb+") as f:
+                self._trim_torn_tail(f)
+                f.seek(0, os.SEEK_END)
+                f.write(data)
+
+    def read(self, cursor: Optional[str] = None, limit: int = 1000) -> Tuple[List[Dict[str, Any]], str]:
+        """Up to `limit` events after `cursor` (None: from the oldest kept), and the cursor to resume from."""
+        seq, offset = (int(p) for p in cursor.split(":")) if cursor else (0, 0)
+        events: List[Dict[str, Any]] = []
+        segments = self._segments()
+        for s, path in segments:
+            if s < seq:
+                continue
+            if s > seq:
+                seq, offset = s, 0   # moved on (or the cursor's segment was pruned)
+            try:
+                f = gzip.open(path, "rb") if path.endswith(".gz") else open(path, "rb")
+            except FileNotFoundError:
+                # compressed between listing and opening
+                f = gzip.open(path + ".gz", "rb")
+            with f:
+                f.seek(offset)
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        if s != segments[-1][0]:
+                            # sealed before _seal trimmed torn lines; the cursor moves past it
+                            print(f"Event log: skipping a torn line at {path}:{offset}")
+                        break   # still being written
+                    offset += len(line)
+                    events.append(json.loads(line))
+                    if len(events) >= limit:
+                        return events, f"{seq}:{offset}"
+        return events, f"{seq}:{offset}"
@@ -0,0 +1,83 @@
+# storage/ids.py
+"""
+Time-ordered unique IDs for records and events (snowflake layout).
+
+An ID is a prefix plus 21 digits:
+    Unix time in milliseconds (13) | node id (4, 0-1023) | sequence (4, 0-4095)
+so IDs of one kind sort by creation time, and never collide across the threads of a
+process or across the processes sharing data/ (the API workers and the bot): each process
+holds an fcntl lock on one of data/nodes/<n>.lock for as long as it runs, which makes its
+node id unique. NOETICA_NODE_ID pins the node id instead (e.g. for hosts without fcntl).
+
+The IDs written before this scheme were the prefix plus Unix seconds ('A', 'Q'),
+milliseconds ('S', 'QQ', 'QA') or nanoseconds ('E'). Those digits are a prefix of the
+new layout's, so old and new IDs of one kind still sort by creation time together.
+"""
+from __future__ import annotations
+import os, random, threading, time
+from typing import Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: fall back to a random node id
+    fcntl = None
+
+NODE_BITS, SEQ_BITS = 10, 12
+MAX_NODE, MAX_SEQ = (1 << NODE_BITS) - 1, (1 << SEQ_BITS) - 1
+NODES_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "nodes")
+
+class IdGenerator:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._node = None
+        self._node_fd = None
+        self._last_ms = 0
+        self._seq = 0
+
+    def _claim_node(self) -> int:
+        if os.environ.get("NOETICA_NODE_ID"):
+            return int(os.environ["NOETICA_NODE_ID"]) & MAX_NODE
+        if fcntl is None:
+            return random.randint(0, MAX_NODE)
+        os.makedirs(NODES_DIR, exist_ok=True)
+        start = os.getpid() & MAX_NODE
+        for i in range(MAX_NODE + 1):
+            node = (start + i) & MAX_NODE
+            fd = os.open(os.path.join(NODES_DIR, f"{node}.lock"), os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(fd)
+                continue
+            self._node_fd = fd   # held (never released) until the process exits
+            return node
+        raise RuntimeError(f"All {MAX_NODE + 1} node ids in {NODES_DIR} are taken")
+
+    def _after_fork(self):
+        # A forked child shares the parent's lock, so it must claim a node of its own.
+        self._lock = threading.Lock()
+        self._node = self._node_fd = None
+
+    def next(self) -> Tuple[int, int, int]:
+        """(milliseconds, node id, sequence) of a new ID."""
+        with self._lock:
+            if self._node is None:
+                self._node = self._claim_node()
+            now = int(time.time() * 1000)
+            if now > self._last_ms:
+                self._last_ms, self._seq = now, 0
+            else:
+                # Same millisecond, or the clock stepped back: stay monotonic.
+                self._seq = (self._seq + 1) & MAX_SEQ
+                if self._seq == 0:
+                    self._last_ms += 1
+            return self._last_ms, self._node, self._seq
+
+_generator = IdGenerator()
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_generator._after_fork)
+
+def new_id(prefix: str = "") -> str:
+    """A new unique, time-ordered ID such as 'A176067545212300070012'."""
+    ms, node, seq = _generator.next()
+    return f"{prefix}{ms:013d}{node:04d}{seq:04d}"
@@ -0,0 +1,91 @@
+# storage/journal.py
+"""
+Append-only write-ahead log for the JSON document store.
+
+Each save() appends one compact JSON line with the records it touched; data.json
+becomes a periodic snapshot that the log tail is replayed on top of.
+"""
+from __future__ import annotations
+import json, os, threading
+from typing import Dict, Any, List, Tuple
+
+class Journal:
+    def __init__(self, path: str):
+        self.path = path
+        self._f = None
+        self._cond = threading.Condition()
+        self._written = 0   # highest generation handed to the OS
+        self._synced = 0    # highest generation known to be on disk
+        self._syncing = False
+
+    def size(self) -> int:
+        try:
+            return os.path.getsize(self.path)
+        except FileNotFoundError:
+            return 0
+
+    def read(self, offset: int = 0) -> Tuple[List[Dict[str, Any]], int]:
+        """Return the complete records after byte `offset` and the offset just past them."""
+        try:
+            with open(self.path, "rb") as f:
+                f.seek(offset)
+                chunk = f.read()
+        except FileNotFoundError:
+            return [], 0
+        records, pos = [], offset
+        for line in chunk.splitlines(keepends=True):
+            if not line.endswith(b"\n"):
+                break  # torn tail of a writer that crashed (or is still writing)
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                break
+            pos += len(line)
+        return records, pos
+
+    def _file(self):
+        if self._f is None:
+            self._f = open(self.path, "ab")
+        return self._f
+
+    def append(self, record: Dict[str, Any], at: int) -> int:
+        """
+        Write one record without fsync and return the new end offset.
+        `at` is the end of the last good record; anything after it is a torn tail.
+        Caller holds the storage lock.
+        """
+        f = self._file()
+        if os.fstat(f.fileno()).st_size > at:
+            f.truncate(at)
+        f.write((json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n").encode("utf-8"))
+        f.flush()
+        self._written = record["gen"]
+        return os.fstat(f.fileno()).st_size
+
+    def sync(self, gen: int):
+        """Block until record `gen` is durable. Concurrent callers share one fsync (group commit)."""
+        with self._cond:
+            while self._synced < gen:
+                if self._syncing:
+                    self._cond.wait()
+                    continue
+                self._syncing = True
+                target, f = self._written, self._f
+                self._cond.release()
+                try:
+                    if f is not None:
+                        os.fsync(f.fileno())
+                finally:
+                    self._cond.acquire()
+                    self._syncing = False
+                    self._cond.notify_all()
+                self._synced = max(self._synced, target)
+
+    def reset(self, gen: int):
+        """Empty the log once a snapshot containing generation `gen` is on disk."""
+        if self._f is None and not os.path.exists(self.path):
+            return
+        self._file().truncate(0)
+        with self._cond:
+            self._written = self._synced = max(self._synced, gen)
+            self._cond.notify_all()
@@ -0,0 +1,73 @@
+# storage/locking.py
+"""
+Inter-process lock for the shared data directory.
+
+The api and bot containers both mount ./data, so a threading.Lock is not enough to
+serialise their read-modify-write cycles. FileLock takes an fcntl advisory lock on a
+lock file, polling with exponential backoff so it can time out, and keeps wait metrics.
+"""
+from __future__ import annotations
+import os, random, threading, time
+from typing import Dict, Any
+
+try:
+    import fcntl
+except ImportError:  # Windows: only the in-process lock applies
+    fcntl = None
+
+class FileLock:
+    def __init__(self, path: str, timeout: float = 30.0):
+        self.path = path
+        self.timeout = timeout
+        self._fd = None
+        self._stats_lock = threading.Lock()
+        self._stats = {"acquired": 0, "contended": 0, "timeouts": 0, "conflicts": 0,
+                       "wait_total_s": 0.0, "wait_max_s": 0.0}
+
+    def acquire(self):
+        if fcntl is None:
+            return
+        if self._fd is None:
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        start = time.monotonic()
+        delay = 0.001
+        contended = False
+        while True:
+            try:
+                fcntl.flock(self._fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                contended = True
+                if time.monotonic() - start >= self.timeout:
+                    self._record(timeouts=1)
+                    raise TimeoutError(f"Timed out after {self.timeout}s waiting for {self.path}")
+                time.sleep(delay * (1 + random.random()))
+                delay = min(delay * 2, 0.1)
+        waited = time.monotonic() - start
+        self._record(acquired=1, contended=int(contended), wait_total_s=waited, wait_max_s=waited)
+
+    def release(self):
+        if fcntl is not None and self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+    def _record(self, **deltas):
+        with self._stats_lock:
+            for k, v in deltas.items():
+                if k == "wait_max_s":
+                    self._stats[k] = max(self._stats[k], v)
+                else:
+                    self._stats[k] += v
+
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            out = dict(self._stats)
+        out["wait_avg_s"] = out["wait_total_s"] / out["acquired"] if out["acquired"] else 0.0
+        out["interprocess"] = fcntl is not None
+        return out
@@ -0,0 +1,107 @@
+# storage/outbox.py
+"""
+Durable outbox for Telegram work, kept in the 'outbox' collection: snapshot DMs to
+teachers, and downloads of files students submitted through the bot.
+
+There is at most one pending job per key (e.g. "snapshot:<teacher>"), so repeated
+requests within the debounce window collapse into one delivery. Jobs are leased by the
+worker in server/outbox.py while being delivered; a request that arrives mid-delivery
+bumps the job's seq so it is sent again afterwards.
+"""
+from __future__ import annotations
+import os, time
+from typing import Dict, Any, List, Optional
+from storage.storage import save, _get, _all
+
+SNAPSHOT_DEBOUNCE_SECONDS = float(os.environ.get("NOETICA_SNAPSHOT_DEBOUNCE_SECONDS") or 10)
+
+def request_snapshot(teacher_tg_id: int):
+    """Queue a snapshot DM for a teacher; requests within the debounce window share one message."""
+    key = f"snapshot:{teacher_tg_id}"
+    job = _get("outbox", key)
+    if job and job["lease_until"] <= time.time():
+        return  # already queued; the text is built when it is sent
+    def mut(d):
+        now = time.time()
+        job = d["outbox"].get(key)
+        if job:
+            d["outbox"][key] = {**job, "seq": job["seq"] + 1}
+        else:
+            d["outbox"][key] = {"key": key, "kind": "snapshot", "teacher_tg_id": teacher_tg_id, "seq": 1,
+                                "due_at": now + SNAPSHOT_DEBOUNCE_SECONDS, "lease_until": 0, "attempts": 0}
+    save(mut)
+
+def claim_outbox(lease_seconds: float, limits: Optional[Dict[str, int]] = None) -> List[Dict[str, Any]]:
+    """Lease every job that is due and not already being delivered, at most limits[kind] of a kind."""
+    now = time.time()
+    limits = dict(limits or {})
+    if not any(j["due_at"] <= now and j["lease_until"] <= now and limits.get(j["kind"], 1) > 0
+               for j in _all("outbox")):
+        return []
+    def mut(d):
+        jobs = []
+        due = sorted((j["due_at"], k) for k, j in d["outbox"].items() if j["due_at"] <= now and j["lease_until"] <= now)
+        left = dict(limits)
+        for _, key in due:
+            kind = d["outbox"][key]["kind"]
+            if kind in left:
+                if left[kind] <= 0:
+                    continue
+                left[kind] -= 1
+            d["outbox"][key] = {**d["outbox"][key], "lease_until": now + lease_seconds}
+            jobs.append(d["outbox"][key])
+        return jobs
+    return save(mut)
+
+def finish_outbox(job: Dict[str, Any], retry_in: Optional[float] = None):
+    """Settle a leased job: done (retry_in=None) or due again after retry_in seconds."""
+    def mut(d):
+        now = time.time()
+        cur = d["outbox"].get(job["key"])
+        if cur is None:
+            return
+        if retry_in is not None:
+            d["outbox"][job["key"]] = {**cur, "due_at": now + retry_in, "lease_until": 0, "attempts": cur["attempts"] + 1}
+        elif cur["seq"] != job["seq"]:
+            # Requested again while this delivery was in flight.
+            d["outbox"][job["key"]] = {**cur, "due_at": now + SNAPSHOT_DEBOUNCE_SECONDS, "lease_until": 0, "attempts": 0}
+        else:
+            del d["outbox"][job["key"]]
+    save(mut)
+
+def set_snapshot_message_id(teacher_tg_id: int, message_id: Optional[int]):
+    """Remember the pinned snapshot message so later snapshots edit it in place."""
+    def mut(d):
+        key = str(teacher_tg_id)
+        if key in d["teachers"]:
+            d["teachers"][key] = {**d["teachers"][key], "snapshot_message_id": message_id}
+    save(mut)
+
+def _fetch_job(file_id: str, now: float) -> Dict[str, Any]:
+    return {"key": f"fetch:{file_id}", "kind": "fetch_file", "file_id": file_id, "seq": 1,
+            "due_at": now, "lease_until": 0, "attempts": 0}
+
+def request_file_fetch(file_id: str):
+    """Queue the download of a file that was submitted through the bot (see server/file_fetch.py)."""
+    key = f"fetch:{file_id}"
+    if _get("outbox", key):
+        return
+    def mut(d):
+        if key not in d["outbox"]:
+            d["outbox"][key] = _fetch_job(file_id, time.time())
+    save(mut)
+
+def queue_missing_file_fetches() -> int:
+    """Queue downloads for submitted files that were never stored locally; returns how many."""
+    queued = {j.get("file_id") for j in _all("outbox") if j["kind"] == "fetch_file"}
+    missing = [f["file_id"] for f in _all("files")
+               if not f.get("local_path") and not f.get("fetch_failed") and f["file_id"] not in queued]
+    if not missing:
+        return 0
+    def mut(d):
+        now = time.time()
+        for file_id in missing:
+            if f"fetch:{file_id}" not in d["outbox"]:
+                d["outbox"][f"fetch:{file_id}"] = _fetch_job(file_id, now)
+    save(mut)
+    return len(missing)
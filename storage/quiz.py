@@ -1,20 +1,35 @@
 # storage/quiz.py
 from __future__ import annotations
-import time
-from typing import Dict, Any, Optional, List
-from storage.storage import load, save, _now_iso
+import os, json
+from contextlib import contextmanager
+from typing import Dict, Any, Optional, List, Tuple
+from storage.storage import DATA_DIR, save, _now_iso, _get, _find, _gradebook_row
+from storage.ids import new_id
+
+try:
+    import fcntl
+except ImportError:  # Windows: shard writes are not locked against completion
+    fcntl = None
+
+# Answers of in-progress attempts are appended to one shard file per attempt instead of
+# rewriting the database; complete_quiz_attempt() folds them into the attempt record.
+# Appends hold a shared flock on the shard and completion an exclusive one, from reading
+# the shard until the attempt is saved as completed and the shard removed, so an answer
+# is either folded in or rejected, never lost.
+ATTEMPTS_DIR = os.path.join(DATA_DIR, "attempts")
+os.makedirs(ATTEMPTS_DIR, exist_ok=True)
 
 def make_quiz_id() -> str:
     """Generate a unique quiz ID"""
-    return "Q" + str(int(time.time()))
+    return new_id("Q")
 
 def make_question_id() -> str:
     """Generate a unique question ID"""
-    return "QQ" + str(int(time.time()*1000))
+    return new_id("QQ")
 
 def make_attempt_id() -> str:
     """Generate a unique attempt ID"""
-    return "QA" + str(int(time.time()*1000))
+    return new_id("QA")
 
 # --- QUIZZES ---
 def create_quiz(class_id: str, title: str, description: str, time_limit_minutes: Optional[int] = None, 
@@ -44,7 +59,7 @@ def create_quiz(class_id: str, title: str, description: str, time_limit_minutes:
         
         # Add event
         d["events"].append({
-            "id": f"E{time.time_ns()}",
+            "id": new_id("E"),
             "type": "quiz_created",
             "actor": d["classes"][class_id]["teacher_tg_id"],
             "payload": {"quiz_id": quiz_id},
@@ -70,9 +85,13 @@ def update_quiz(quiz_id: str, **updates) -> Optional[Dict[str, Any]]:
         if updates.get("status") == "published" and not d["quizzes"][quiz_id].get("published_at"):
             d["quizzes"][quiz_id]["published_at"] = _now_iso()
         
+        # Compile the grading plan when the quiz goes live
+        if updates.get("status") == "published":
+            d["grading_plans"][quiz_id] = _compile_plan(_find("questions", "quiz_id", quiz_id))
+        
         # Add event
         d["events"].append({
-            "id": f"E{time.time_ns()}",
+            "id": new_id("E"),
             "type": "quiz_updated",
             "actor": d["classes"][d["quizzes"][quiz_id]["class_id"]]["teacher_tg_id"],
             "payload": {"quiz_id": quiz_id, "updates": list(updates.keys())},
@@ -85,17 +104,43 @@ def update_quiz(quiz_id: str, **updates) -> Optional[Dict[str, Any]]:
 
 def get_quiz(quiz_id: str) -> Optional[Dict[str, Any]]:
     """Get a quiz by ID"""
-    data = load()
-    if "quizzes" not in data:
-        return None
-    return data["quizzes"].get(quiz_id)
+    return _get("quizzes", quiz_id)
 
 def list_quizzes(class_id: str) -> List[Dict[str, Any]]:
     """List all quizzes for a class"""
-    data = load()
-    if "quizzes" not in data:
-        return []
-    return [q for q in data["quizzes"].values() if q["class_id"] == class_id]
+    return _find("quizzes", "class_id", class_id)
+
+# --- GRADING PLANS ---
+# A quiz's answer key, compiled when it is published and recompiled when its questions
+# change, kept in 'grading_plans' (never sent to students). Each key is
+# [is_short_answer, expected answer (lowercased for short answers), points].
+def _compile_plan(questions: List[Dict[str, Any]]) -> Dict[str, Any]:
+    keys = {}
+    for q in questions:
+        if q["question_type"] in ("multiple_choice", "true_false"):
+            keys[q["question_id"]] = [False, q["correct_answer"], q["points"]]
+        elif q["question_type"] == "short_answer":
+            keys[q["question_id"]] = [True, str(q["correct_answer"]).lower(), q["points"]]
+        # Essay questions need manual grading
+    return {"total_points": sum(q["points"] for q in questions), "keys": keys}
+
+def _recompile_plan(d, quiz_id: str, question_id: str):
+    """Refresh a compiled plan after `question_id` was added, changed or deleted."""
+    if quiz_id not in d["grading_plans"]:
+        return  # not published yet: compiled on publish
+    ids = dict.fromkeys([q["question_id"] for q in _find("questions", "quiz_id", quiz_id)] + [question_id])
+    questions = [q for q in (d["questions"].data.get(i) for i in ids) if q and q["quiz_id"] == quiz_id]
+    d["grading_plans"][quiz_id] = _compile_plan(questions)
+
+def _grade(plan: Dict[str, Any], answers: Dict[str, Any]) -> int:
+    """Percentage score of `answers` under a compiled plan."""
+    earned = 0
+    for question_id, answer in answers.items():
+        key = plan["keys"].get(question_id)
+        if key and (str(answer).lower() if key[0] else answer) == key[1]:
+            earned += key[2]
+    total = plan["total_points"]
+    return round((earned / total) * 100) if total > 0 else 0
 
 # --- QUESTIONS ---
 def add_question(quiz_id: str, question_text: str, question_type: str, options: Optional[List[Dict[str, Any]]] = None,
@@ -130,10 +175,11 @@ def add_question(quiz_id: str, question_text: str, question_type: str, options:
             "created_at": _now_iso(),
             "updated_at": _now_iso()
         }
+        _recompile_plan(d, quiz_id, question_id)
         
         # Add event
         d["events"].append({
-            "id": f"E{time.time_ns()}",
+            "id": new_id("E"),
             "type": "question_added",
             "actor": d["classes"][d["quizzes"][quiz_id]["class_id"]]["teacher_tg_id"],
             "payload": {"quiz_id": quiz_id, "question_id": question_id},
@@ -157,10 +203,11 @@ def update_question(question_id: str, **updates) -> Optional[Dict[str, Any]]:
         
         # Get quiz
         quiz_id = d["questions"][question_id]["quiz_id"]
+        _recompile_plan(d, quiz_id, question_id)
         
         # Add event
         d["events"].append({
-            "id": f"E{time.time_ns()}",
+            "id": new_id("E"),
             "type": "question_updated",
             "actor": d["classes"][d["quizzes"][quiz_id]["class_id"]]["teacher_tg_id"],
             "payload": {"question_id": question_id, "updates": list(updates.keys())},
@@ -183,10 +230,11 @@ def delete_question(question_id: str) -> bool:
         
         # Delete the question
         del d["questions"][question_id]
+        _recompile_plan(d, quiz_id, question_id)
         
         # Add event
         d["events"].append({
-            "id": f"E{time.time_ns()}",
+            "id": new_id("E"),
             "type": "question_deleted",
             "actor": d["classes"][d["quizzes"][quiz_id]["class_id"]]["teacher_tg_id"],
             "payload": {"question_id": question_id},
@@ -199,10 +247,11 @@ def delete_question(question_id: str) -> bool:
 
 def list_questions(quiz_id: str) -> List[Dict[str, Any]]:
     """List all questions for a quiz"""
-    data = load()
-    if "questions" not in data:
-        return []
-    return [q for q in data["questions"].values() if q["quiz_id"] == quiz_id]
+    return _find("questions", "quiz_id", quiz_id)
+
+def get_question(question_id: str) -> Optional[Dict[str, Any]]:
+    """Get a question by ID"""
+    return _get("questions", question_id)
 
 # --- QUIZ ATTEMPTS ---
 def start_quiz_attempt(quiz_id: str, student_tg_id: int) -> Dict[str, Any]:
@@ -247,7 +296,7 @@ def start_quiz_attempt(quiz_id: str, student_tg_id: int) -> Dict[str, Any]:
         
         # Add event
         d["events"].append({
-            "id": f"E{time.time_ns()}",
+            "id": new_id("E"),
             "type": "quiz_attempt_started",
             "actor": student_tg_id,
             "payload": {"quiz_id": quiz_id, "attempt_id": attempt_id},
@@ -258,35 +307,104 @@ def start_quiz_attempt(quiz_id: str, student_tg_id: int) -> Dict[str, Any]:
     
     return save(mut)
 
-def answer_question(attempt_id: str, question_id: str, answer: Any) -> Dict[str, Any]:
-    """Record an answer for a question in a quiz attempt"""
-    def mut(d):
-        # Check if attempts dict exists
-        if "quiz_attempts" not in d or attempt_id not in d["quiz_attempts"]:
-            raise ValueError(f"Attempt {attempt_id} not found")
-        
-        # Check if attempt is in progress
-        if d["quiz_attempts"][attempt_id]["status"] != "in_progress":
+def _shard_path(attempt_id: str) -> str:
+    return os.path.join(ATTEMPTS_DIR, f"{os.path.basename(attempt_id)}.jsonl")
+
+@contextmanager
+def _locked_shard(attempt_id: str, exclusive: bool):
+    """The attempt's shard, opened for appending under a shared or exclusive flock."""
+    fd = os.open(_shard_path(attempt_id), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        yield fd
+    finally:
+        os.close(fd)   # releases the lock
+
+def _append_answers(attempt_id: str, answers: Dict[str, Any]):
+    """Durably append answers to the attempt's shard (one write, then fsync)."""
+    ts = _now_iso()
+    # Leading newline: a record torn by a crash can never swallow the next one.
+    data = "".join("\n" + json.dumps({"question_id": q, "answer": a, "ts": ts}, ensure_ascii=False)
+                   for q, a in answers.items()) + "\n"
+    with _locked_shard(attempt_id, exclusive=False) as fd:
+        # Re-checked under the lock: the attempt may have been completed since it was validated.
+        attempt = _get("quiz_attempts", attempt_id)
+        if not attempt or attempt["status"] != "in_progress":
+            try:
+                os.remove(_shard_path(attempt_id))   # recreated by the open above
+            except FileNotFoundError:
+                pass
             raise ValueError(f"Attempt {attempt_id} is not in progress")
-        
+        os.write(fd, data.encode("utf-8"))
+        os.fsync(fd)
+
+def _read_shard(attempt_id: str) -> Tuple[Dict[str, Any], Optional[str]]:
+    """Answers buffered for an attempt (latest per question) and when the last was given."""
+    answers, last = {}, None
+    try:
+        with open(_shard_path(attempt_id), "rb") as f:
+            lines = f.read().split(b"\n")
+    except FileNotFoundError:
+        return answers, last
+    for line in lines[:-1]:   # the last piece has no newline yet: torn or still being written
+        if not line:
+            continue
+        try:
+            rec = json.loads(line)
+        except ValueError:
+            continue
+        answers[rec["question_id"]] = rec["answer"]
+        last = rec["ts"]
+    return answers, last
+
+def _with_buffered(attempt: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """The attempt as the student sees it: stored answers plus those still in its shard."""
+    if not attempt or attempt["status"] != "in_progress":
+        return attempt
+    answers, last = _read_shard(attempt["attempt_id"])
+    if not answers:
+        return attempt
+    return {**attempt, "answers": {**attempt["answers"], **answers}, "updated_at": last}
+
+def _check_answers(attempt_id: str, answers: Dict[str, Any]) -> Dict[str, Any]:
+    """Validate answers against an in-progress attempt; returns the attempt."""
+    attempt = _get("quiz_attempts", attempt_id)
+    if not attempt:
+        raise ValueError(f"Attempt {attempt_id} not found")
+    
+    # Check if attempt is in progress
+    if attempt["status"] != "in_progress":
+        raise ValueError(f"Attempt {attempt_id} is not in progress")
+    
+    for question_id in answers:
         # Check if question exists
-        if "questions" not in d or question_id not in d["questions"]:
+        question = _get("questions", question_id)
+        if not question:
             raise ValueError(f"Question {question_id} not found")
         
         # Check if question belongs to the quiz
-        if d["questions"][question_id]["quiz_id"] != d["quiz_attempts"][attempt_id]["quiz_id"]:
+        if question["quiz_id"] != attempt["quiz_id"]:
             raise ValueError(f"Question {question_id} does not belong to this quiz")
-        
-        # Record the answer
-        d["quiz_attempts"][attempt_id]["answers"][question_id] = answer
-        d["quiz_attempts"][attempt_id]["updated_at"] = _now_iso()
-        
-        return d["quiz_attempts"][attempt_id]
-    
-    return save(mut)
+    return attempt
+
+def answer_question(attempt_id: str, question_id: str, answer: Any) -> Dict[str, Any]:
+    """Record an answer for a question in a quiz attempt"""
+    return answer_questions(attempt_id, {question_id: answer})
 
-def complete_quiz_attempt(attempt_id: str) -> Dict[str, Any]:
-    """Complete a quiz attempt and calculate the score"""
+def answer_questions(attempt_id: str, answers: Dict[str, Any]) -> Dict[str, Any]:
+    """Record several answers at once (all or none: one invalid question rejects the batch)"""
+    attempt = _check_answers(attempt_id, answers)
+    # Buffer the answers in the attempt's shard; they are merged on completion
+    if answers:
+        _append_answers(attempt_id, answers)
+    return _with_buffered(attempt)
+
+def complete_quiz_attempt(attempt_id: str, answers: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Complete a quiz attempt and calculate the score, recording any final `answers` in the same save"""
+    if answers:
+        _check_answers(attempt_id, answers)
+    
     def mut(d):
         # Check if attempts dict exists
         if "quiz_attempts" not in d or attempt_id not in d["quiz_attempts"]:
@@ -296,33 +414,17 @@ def complete_quiz_attempt(attempt_id: str) -> Dict[str, Any]:
         if d["quiz_attempts"][attempt_id]["status"] != "in_progress":
             raise ValueError(f"Attempt {attempt_id} is not in progress")
         
-        # Get quiz and questions
+        # Fold in the answers buffered in the attempt's shard
+        buffered, _ = _read_shard(attempt_id)
+        if buffered or answers:
+            d["quiz_attempts"][attempt_id]["answers"] = {**d["quiz_attempts"][attempt_id]["answers"], **buffered, **(answers or {})}
+        
+        # Grade against the quiz's compiled plan (compiled here for quizzes published before plans existed)
         quiz_id = d["quiz_attempts"][attempt_id]["quiz_id"]
-        questions = [q for q in d["questions"].values() if q["quiz_id"] == quiz_id]
-        
-        # Calculate score
-        total_points = sum(q["points"] for q in questions)
-        earned_points = 0
-        
-        for question in questions:
-            question_id = question["question_id"]
-            if question_id not in d["quiz_attempts"][attempt_id]["answers"]:
-                continue
-            
-            student_answer = d["quiz_attempts"][attempt_id]["answers"][question_id]
-            
-            # Check if answer is correct based on question type
-            if question["question_type"] in ["multiple_choice", "true_false"]:
-                if student_answer == question["correct_answer"]:
-                    earned_points += question["points"]
-            elif question["question_type"] == "short_answer":
-                # Case-insensitive comparison for short answer
-                if str(student_answer).lower() == str(question["correct_answer"]).lower():
-                    earned_points += question["points"]
-            # Essay questions need manual grading
-        
-        # Calculate percentage score
-        score = round((earned_points / total_points) * 100) if total_points > 0 else 0
+        plan = d["grading_plans"].data.get(quiz_id)
+        if plan is None:
+            plan = d["grading_plans"][quiz_id] = _compile_plan(_find("questions", "quiz_id", quiz_id))
+        score = _grade(plan, d["quiz_attempts"][attempt_id]["answers"])
         
         # Update attempt
         d["quiz_attempts"][attempt_id]["end_time"] = _now_iso()
@@ -330,9 +432,16 @@ def complete_quiz_attempt(attempt_id: str) -> Dict[str, Any]:
         d["quiz_attempts"][attempt_id]["status"] = "completed"
         d["quiz_attempts"][attempt_id]["updated_at"] = _now_iso()
         
+        # Update the student's gradebook cell for the quiz
+        class_id = d["quizzes"].data.get(quiz_id, {}).get("class_id")
+        if class_id:
+            row = _gradebook_row(d, class_id, d["quiz_attempts"][attempt_id]["student_tg_id"])
+            cell = row["cells"].get(quiz_id, {"best_score": score, "attempts": 0})
+            row["cells"][quiz_id] = {"best_score": max(cell["best_score"], score), "attempts": cell["attempts"] + 1}
+        
         # Add event
         d["events"].append({
-            "id": f"E{time.time_ns()}",
+            "id": new_id("E"),
             "type": "quiz_attempt_completed",
             "actor": d["quiz_attempts"][attempt_id]["student_tg_id"],
             "payload": {"quiz_id": quiz_id, "attempt_id": attempt_id, "score": score},
@@ -341,31 +450,42 @@ def complete_quiz_attempt(attempt_id: str) -> Dict[str, Any]:
         
         return d["quiz_attempts"][attempt_id]
     
-    return save(mut)
+    with _locked_shard(attempt_id, exclusive=True):
+        attempt = save(mut)
+        try:
+            os.remove(_shard_path(attempt_id))
+        except FileNotFoundError:
+            pass
+    return attempt
+
+def recover_attempt_shards() -> int:
+    """
+    Remove shards left behind by a crash between completing an attempt and deleting its
+    shard (their answers are already in the record). Shards of attempts still in progress
+    are kept: reads and completion merge them. Returns the number removed.
+    """
+    removed = 0
+    for name in os.listdir(ATTEMPTS_DIR):
+        if not name.endswith(".jsonl"):
+            continue
+        attempt = _get("quiz_attempts", name[:-len(".jsonl")])
+        if not attempt or attempt["status"] != "in_progress":
+            os.remove(os.path.join(ATTEMPTS_DIR, name))
+            removed += 1
+    return removed
 
 def get_quiz_attempt(attempt_id: str) -> Optional[Dict[str, Any]]:
     """Get a quiz attempt by ID"""
-    data = load()
-    if "quiz_attempts" not in data:
-        return None
-    return data["quiz_attempts"].get(attempt_id)
+    return _with_buffered(_get("quiz_attempts", attempt_id))
 
 def list_student_quiz_attempts(student_tg_id: int, quiz_id: Optional[str] = None) -> List[Dict[str, Any]]:
     """List all quiz attempts for a student, optionally filtered by quiz_id"""
-    data = load()
-    if "quiz_attempts" not in data:
-        return []
-    
-    attempts = [a for a in data["quiz_attempts"].values() if a["student_tg_id"] == student_tg_id]
-    
     if quiz_id:
-        attempts = [a for a in attempts if a["quiz_id"] == quiz_id]
-    
-    return attempts
+        attempts = _find("quiz_attempts", ("student_tg_id", "quiz_id"), (student_tg_id, quiz_id))
+    else:
+        attempts = _find("quiz_attempts", "student_tg_id", student_tg_id)
+    return [_with_buffered(a) for a in attempts]
 
 def list_quiz_attempts(quiz_id: str) -> List[Dict[str, Any]]:
     """List all attempts for a quiz"""
-    data = load()
-    if "quiz_attempts" not in data:
-        return []
-    return [a for a in data["quiz_attempts"].values() if a["quiz_id"] == quiz_id]
+    return [_with_buffered(a) for a in _find("quiz_attempts", "quiz_id", quiz_id)]
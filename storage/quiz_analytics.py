@@ -0,0 +1,143 @@
+# storage/quiz_analytics.py
+"""
+Bulk regrading and item analysis for quizzes, computed with NumPy.
+
+The completed attempts of a quiz are encoded once into an attempts x questions matrix of
+answer codes (-1 = unanswered, otherwise an index into that question's distinct
+answers). Scores, per-question difficulty and discrimination, and answer distributions
+are then array operations over that matrix.
+"""
+from __future__ import annotations
+from typing import Dict, Any, List, Tuple
+import numpy as np
+from storage.storage import save, _now_iso, _find, _gradebook_row, _quiz_cell
+from storage.ids import new_id
+from storage.quiz import _compile_plan
+
+def _answer_key(answer: Any, short_answer: bool) -> Any:
+    """Hashable form of an answer that compares the way quiz._grade() compares."""
+    if short_answer:
+        return str(answer).lower()
+    try:
+        hash(answer)
+        return answer
+    except TypeError:
+        return repr(answer)
+
+def _encode(plan: Dict[str, Any], attempts: List[Dict[str, Any]]) -> Tuple[List[str], np.ndarray, List[Dict[Any, int]]]:
+    """Question ids, the attempts x questions code matrix, and each question's answer -> code map."""
+    qids = list(plan["keys"])
+    vocab: List[Dict[Any, int]] = [{} for _ in qids]
+    codes = np.full((len(attempts), len(qids)), -1, dtype=np.int32)
+    for j, qid in enumerate(qids):
+        short, seen = plan["keys"][qid][0], vocab[j]
+        col = [seen.setdefault(_answer_key(a["answers"][qid], short), len(seen)) if qid in a["answers"] else -1
+               for a in attempts]
+        codes[:, j] = col
+    return qids, codes, vocab
+
+def _correct(plan: Dict[str, Any], qids: List[str], codes: np.ndarray, vocab: List[Dict[Any, int]]) -> np.ndarray:
+    """Boolean attempts x questions matrix: answer matches the key."""
+    key_codes = np.array([vocab[j].get(_answer_key(plan["keys"][q][1], plan["keys"][q][0]), -2)
+                          for j, q in enumerate(qids)], dtype=np.int32)
+    return codes == key_codes[None, :]
+
+def _scores(plan: Dict[str, Any], correct: np.ndarray, qids: List[str]) -> np.ndarray:
+    points = np.array([plan["keys"][q][2] for q in qids], dtype=float)
+    total = plan["total_points"]
+    if total <= 0:
+        return np.zeros(correct.shape[0], dtype=int)
+    # np.round rounds half to even, like the round() used by quiz._grade()
+    return np.round(correct @ points / total * 100).astype(int)
+
+def _completed(quiz_id: str) -> List[Dict[str, Any]]:
+    return [a for a in _find("quiz_attempts", "quiz_id", quiz_id) if a["status"] == "completed"]
+
+def regrade_quiz(quiz_id: str) -> Dict[str, Any]:
+    """Recompile the quiz's grading plan and rescore every completed attempt against it."""
+    def mut(d):
+        # Scored inside the save, against the attempts and questions it commits on top of,
+        # so an attempt completed concurrently is never overwritten with a stale score.
+        plan = _compile_plan(_find("questions", "quiz_id", quiz_id))
+        attempts = _completed(quiz_id)
+        qids, codes, vocab = _encode(plan, attempts)
+        scores = _scores(plan, _correct(plan, qids, codes, vocab), qids)
+        new_scores = {a["attempt_id"]: int(s) for a, s in zip(attempts, scores) if a["score"] != s}
+        # every score of the students whose best score may have moved, for their gradebook cells
+        regraded = {a["student_tg_id"] for a in attempts if a["attempt_id"] in new_scores}
+        student_scores: Dict[int, List[int]] = {}
+        for a, s in zip(attempts, scores):
+            if a["student_tg_id"] in regraded:
+                student_scores.setdefault(a["student_tg_id"], []).append(int(s))
+
+        d["grading_plans"][quiz_id] = plan
+        now = _now_iso()
+        for attempt_id, score in new_scores.items():
+            d["quiz_attempts"][attempt_id] = {**d["quiz_attempts"][attempt_id], "score": score, "updated_at": now}
+        class_id = d["quizzes"][quiz_id]["class_id"]
+        for student_tg_id, s in student_scores.items():
+            _gradebook_row(d, class_id, student_tg_id)["cells"][quiz_id] = _quiz_cell(s)
+        d["events"].append({
+            "id": new_id("E"),
+            "type": "quiz_regraded",
+            "actor": d["classes"][class_id]["teacher_tg_id"],
+            "payload": {"quiz_id": quiz_id, "changed": len(new_scores)},
+            "ts": now
+        })
+        return {"quiz_id": quiz_id, "attempts": len(attempts), "changed": len(new_scores)}
+
+    return save(mut)
+
+def item_analysis(quiz_id: str, top_answers: int = 10) -> Dict[str, Any]:
+    """
+    Per auto-graded question: difficulty (share answering correctly), discrimination
+    (point-biserial correlation with the rest of the score) and the answer distribution.
+    """
+    plan = _compile_plan(_find("questions", "quiz_id", quiz_id))
+    attempts = _completed(quiz_id)
+    qids, codes, vocab = _encode(plan, attempts)
+    correct = _correct(plan, qids, codes, vocab).astype(float)
+    n = len(attempts)
+
+    difficulty = discrimination = np.full(len(qids), np.nan)
+    if n:
+        points = np.array([plan["keys"][q][2] for q in qids], dtype=float)
+        earned = correct * points[None, :]
+        rest = earned.sum(axis=1, keepdims=True) - earned   # score without the item itself
+        xc, rc = correct - correct.mean(axis=0), rest - rest.mean(axis=0)
+        den = np.sqrt((xc ** 2).sum(axis=0) * (rc ** 2).sum(axis=0))
+        with np.errstate(invalid="ignore", divide="ignore"):
+            discrimination = np.where(den > 0, (xc * rc).sum(axis=0) / den, np.nan)
+        difficulty = correct.mean(axis=0)
+
+    items = []
+    for j, qid in enumerate(qids):
+        counts = np.bincount(codes[:, j] + 1, minlength=len(vocab[j]) + 1)   # slot 0: unanswered
+        labels = list(vocab[j])
+        order = np.argsort(-counts[1:], kind="stable")[:top_answers]
+        items.append({
+            "question_id": qid,
+            "difficulty": None if np.isnan(difficulty[j]) else round(float(difficulty[j]), 3),
+            "discrimination": None if np.isnan(discrimination[j]) else round(float(discrimination[j]), 3),
+            "unanswered": int(counts[0]),
+            "answers": [{"answer": labels[k], "count": int(counts[k + 1])} for k in order if counts[k + 1]],
+        })
+    scores = _scores(plan, correct.astype(bool), qids)
+    return {
+        "quiz_id": quiz_id,
+        "attempts": n,
+        "mean_score": round(float(scores.mean()), 1) if n else None,
+        "items": items,
+    }
+
+def best_scores(attempts: List[Dict[str, Any]]) -> Dict[int, Dict[str, Any]]:
+    """student_tg_id -> attempt count and best score (None until one is graded)."""
+    if not attempts:
+        return {}
+    students, inverse = np.unique(np.array([a["student_tg_id"] for a in attempts]), return_inverse=True)
+    counts = np.bincount(inverse, minlength=len(students))
+    scores = np.array([-1 if a["score"] is None else a["score"] for a in attempts])
+    best = np.full(len(students), -1)
+    np.maximum.at(best, inverse, scores)
+    return {int(s): {"attempt_count": int(c), "best_score": None if b < 0 else int(b)}
+            for s, c, b in zip(students, counts, best)}
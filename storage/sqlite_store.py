@@ -0,0 +1,309 @@
+# storage/sqlite_store.py
+"""
+SQLite backend for the storage functions (NOETICA_STORAGE_BACKEND=sqlite).
+
+Every collection of data.json becomes a table of JSON records under the same keys, with
+the fields the read helpers filter on copied into indexed columns. Mutations run the same
+mutate functions as the JSON store, inside one BEGIN IMMEDIATE transaction; the database
+runs in WAL mode so readers never wait for a writer. Events go to the shared event log
+(storage/events.py) once their transaction commits.
+
+Import an existing JSON database once with:
+    NOETICA_STORAGE_BACKEND=sqlite python -m storage.sqlite_store migrate [path/to/data.json]
+"""
+from __future__ import annotations
+import json, os, sys, sqlite3, threading
+from contextlib import contextmanager
+from typing import Dict, Any, Optional, List, Union, Tuple
+from storage.storage import DATA_PATH, SQLITE_PATH, _COLLECTIONS, _INDEXES, _Collection, _replay, _upgrade, _now_iso, _events
+from storage.journal import Journal
+
+# collection -> record fields stored in their own columns, and the (composite) indexes over them
+_COLUMNS: Dict[str, Tuple[str, ...]] = {
+    name: tuple(dict.fromkeys(f for field in fields for f in (field if isinstance(field, tuple) else (field,))))
+    for name, fields in _INDEXES.items()
+}
+
+_local = threading.local()
+_tables: set = set()
+_schema_lock = threading.Lock()
+_migrate_lock = threading.Lock()
+_migrated = False   # one-time migrations (_migrate) done by this process
+
+def _dumps(obj: Any) -> str:
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+def _conn() -> sqlite3.Connection:
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(SQLITE_PATH, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        _migrate(conn)
+        _local.conn = conn
+    return conn
+
+def _migrate(conn: sqlite3.Connection):
+    """Create the tables and run the one-time migrations, once per process."""
+    global _migrated
+    with _migrate_lock:
+        if _migrated:
+            return
+        had_gradebook = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'gradebook_rows'").fetchone()
+        for name in _COLLECTIONS:
+            _ensure_table(conn, name)
+        _move_legacy_events(conn)
+        if not had_gradebook:
+            _backfill_gradebook_rows(conn)
+        _migrated = True
+
+def _move_legacy_events(conn: sqlite3.Connection):
+    """Databases created before the event log kept events in a table: move them out once."""
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'events'").fetchone():
+            _events.append([json.loads(d) for (d,) in conn.execute("SELECT data FROM events ORDER BY seq")])
+            conn.execute("DROP TABLE events")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
+def _backfill_gradebook_rows(conn: sqlite3.Connection):
+    """Databases created before the class gradebook: derive its rows once."""
+    from storage.storage import _build_gradebook_rows   # defined after storage.py imports this module
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        doc = {name: {k: json.loads(d) for k, d in conn.execute(f"SELECT key, data FROM {name}")}
+               for name in ("students", "enrollments", "assignments", "submissions", "quizzes", "quiz_attempts")}
+        _upsert(conn, "gradebook_rows", list(_build_gradebook_rows(doc).items()))
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
+def _ensure_table(conn: sqlite3.Connection, name: str):
+    if name in _tables:
+        return
+    with _schema_lock:
+        cols = _COLUMNS.get(name, ())
+        # Columns are untyped so ints and strings compare exactly like they do in Python.
+        conn.execute(f"CREATE TABLE IF NOT EXISTS {name} (key TEXT PRIMARY KEY, data TEXT NOT NULL"
+                     + "".join(f", {c}" for c in cols) + ")")
+        existing = {row[1] for row in conn.execute(f"PRAGMA table_info({name})")}
+        for c in cols:
+            if c not in existing:
+                # Field indexed since the table was created: add and backfill the column.
+                conn.execute(f"ALTER TABLE {name} ADD COLUMN {c}")
+                conn.execute(f"UPDATE {name} SET {c} = json_extract(data, '$.{c}')")
+        for field in _INDEXES.get(name, ()):
+            combo = field if isinstance(field, tuple) else (field,)
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {name}_{'_'.join(combo)} ON {name} ({', '.join(combo)})")
+        _tables.add(name)
+
+def _upsert(conn: sqlite3.Connection, name: str, rows: List[Tuple[str, Dict[str, Any]]]):
+    cols = _COLUMNS.get(name, ())
+    conn.executemany(
+        f"INSERT INTO {name} (key, data{''.join(', ' + c for c in cols)}) VALUES (?, ?{', ?' * len(cols)}) "
+        f"ON CONFLICT(key) DO UPDATE SET data = excluded.data{''.join(f', {c} = excluded.{c}' for c in cols)}",
+        [(key, _dumps(rec), *(rec.get(c) for c in cols)) for key, rec in rows])
+
+def _read_meta(conn: sqlite3.Connection) -> Dict[str, Any]:
+    meta = {"version": 1, "generation": 0}
+    meta.update({k: json.loads(v) for k, v in conn.execute("SELECT key, value FROM meta")})
+    return meta
+
+# --- TRANSACTIONS ---
+class _Table:
+    """Dict-like window onto one table that loads records on demand during a transaction."""
+    def __init__(self, conn: sqlite3.Connection, name: str):
+        self.conn, self.name = conn, name
+        self.rows: Dict[str, Optional[Dict[str, Any]]] = {}   # key -> record, None if absent
+        self.raw: Dict[str, str] = {}                         # key -> JSON as read, to skip no-op writes
+        self._complete = False
+
+    def _load(self, key):
+        if key not in self.rows:
+            row = self.conn.execute(f"SELECT data FROM {self.name} WHERE key = ?", (key,)).fetchone()
+            self.rows[key] = json.loads(row[0]) if row else None
+            if row:
+                self.raw[key] = row[0]
+        return self.rows[key]
+
+    def __contains__(self, key): return self._load(key) is not None
+
+    def __getitem__(self, key):
+        rec = self._load(key)
+        if rec is None:
+            raise KeyError(key)
+        return rec
+
+    def __setitem__(self, key, value): self.rows[key] = value
+
+    def __delitem__(self, key):
+        self[key]
+        self.rows[key] = None
+
+    def get(self, key, default=None):
+        rec = self._load(key)
+        return default if rec is None else rec
+
+    def pop(self, key, *default):
+        rec = self._load(key)
+        if rec is None:
+            if default:
+                return default[0]
+            raise KeyError(key)
+        self.rows[key] = None
+        return rec
+
+    def items(self):
+        if not self._complete:
+            for key, data in self.conn.execute(f"SELECT key, data FROM {self.name} ORDER BY rowid"):
+                if key not in self.rows:
+                    self.rows[key], self.raw[key] = json.loads(data), data
+            self._complete = True
+        return [(k, r) for k, r in self.rows.items() if r is not None]
+
+    def keys(self): return [k for k, _ in self.items()]
+    def values(self): return [r for _, r in self.items()]
+    def __iter__(self): return iter(self.keys())
+    def __len__(self): return len(self.items())
+
+class _Doc:
+    """The SQLite counterpart of storage._Tracked: what mutate functions see as `d`."""
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+        self.meta = _read_meta(conn)
+        self.touched: Dict[tuple, None] = {}
+        self.events: List[Dict[str, Any]] = []
+        self._views: Dict[str, _Collection] = {}
+
+    def __getitem__(self, name):
+        if name == "events":
+            return self.events
+        if name == "meta":
+            return self.meta
+        view = self._views.get(name)
+        if view is None:
+            _ensure_table(self.conn, name)
+            view = self._views[name] = _Collection(name, _Table(self.conn, name), self.touched, private=True)
+        return view
+
+    def __setitem__(self, name, value):
+        for key, rec in value.items():
+            self[name][key] = rec
+
+    def __contains__(self, name): return True
+
+    def flush(self):
+        puts: Dict[str, List[Tuple[str, Dict[str, Any]]]] = {}
+        for name, key in self.touched:
+            table = self._views[name].data
+            rec = table.rows.get(key)
+            if rec is None:
+                if key in table.raw:
+                    self.conn.execute(f"DELETE FROM {name} WHERE key = ?", (key,))
+            elif table.raw.get(key) != _dumps(rec):
+                puts.setdefault(name, []).append((key, rec))
+        for name, rows in puts.items():
+            _upsert(self.conn, name, rows)
+        self.conn.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                              [(k, _dumps(v)) for k, v in self.meta.items()])
+
+def save(mutate_fn):
+    conn = _conn()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        doc = _Doc(conn)
+        res = mutate_fn(doc)
+        doc.meta["last_updated"] = _now_iso()
+        doc.meta["generation"] = doc.meta.get("generation", 0) + 1
+        doc.flush()
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+    _events.append(doc.events)
+    return res
+
+# --- READS ---
+@contextmanager
+def read_transaction():
+    """Pin one WAL snapshot for all reads in the block."""
+    conn = _conn()
+    if conn.in_transaction:
+        yield
+        return
+    conn.execute("BEGIN")
+    try:
+        yield
+    finally:
+        conn.execute("COMMIT")
+
+def get(name: str, key: str) -> Optional[Dict[str, Any]]:
+    conn = _conn()
+    _ensure_table(conn, name)
+    row = conn.execute(f"SELECT data FROM {name} WHERE key = ?", (key,)).fetchone()
+    return json.loads(row[0]) if row else None
+
+def find(name: str, field: Union[str, Tuple[str, ...]], value: Any) -> List[Dict[str, Any]]:
+    conn = _conn()
+    _ensure_table(conn, name)
+    fields, values = (field, value) if isinstance(field, tuple) else ((field,), (value,))
+    cols = _COLUMNS.get(name, ())
+    where = " AND ".join(f"{f} = ?" if f in cols else f"json_extract(data, '$.{f}') = ?" for f in fields)
+    return [json.loads(d) for (d,) in conn.execute(f"SELECT data FROM {name} WHERE {where} ORDER BY rowid", values)]
+
+def all(name: str) -> List[Dict[str, Any]]:
+    conn = _conn()
+    _ensure_table(conn, name)
+    return [json.loads(d) for (d,) in conn.execute(f"SELECT data FROM {name} ORDER BY rowid")]
+
+def export() -> Dict[str, Any]:
+    """Materialise the whole database in the data.json layout (used by load())."""
+    conn = _conn()
+    doc: Dict[str, Any] = {"meta": _read_meta(conn)}
+    tables = [n for (n,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+              if n not in ("meta", "sqlite_sequence")]
+    for name in tables:
+        doc[name] = {k: json.loads(d) for k, d in conn.execute(f"SELECT key, data FROM {name} ORDER BY rowid")}
+    return doc
+
+# --- MIGRATION ---
+def migrate_from_json(path: str = DATA_PATH) -> Dict[str, int]:
+    """Import a data.json snapshot (plus its journal, if any) into the SQLite database."""
+    with open(path, "r", encoding="utf-8") as f:
+        doc = _upgrade(json.load(f))
+    records, _ = Journal(os.path.join(os.path.dirname(os.path.abspath(path)), "data.journal")).read(0)
+    if records:
+        doc = _replay(doc, records)
+    conn = _conn()
+    counts = {}
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        for name, coll in doc.items():
+            if name in ("meta", "events") or not isinstance(coll, dict):
+                continue
+            _ensure_table(conn, name)
+            _upsert(conn, name, list(coll.items()))
+            counts[name] = len(coll)
+        conn.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                         [(k, _dumps(v)) for k, v in doc["meta"].items()])
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+    events = doc.get("events", [])
+    _events.append(events)
+    counts["events"] = len(events)
+    return counts
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] != "migrate":
+        raise SystemExit("usage: python -m storage.sqlite_store migrate [path/to/data.json]")
+    src = sys.argv[2] if len(sys.argv) > 2 else DATA_PATH
+    for name, n in migrate_from_json(src).items():
+        print(f"{name}: {n}")
+    print(f"Imported {src} into {SQLITE_PATH}")
@@ -1,7 +1,12 @@
 from __future__ import annotations
-import json, os, time, threading, tempfile, shutil, csv, uuid
+import io, json, os, time, threading, tempfile, shutil, csv, uuid, copy, heapq
+from contextlib import contextmanager
 from datetime import datetime, timezone
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, Iterable, Iterator
+from storage.journal import Journal
+from storage.events import EventLog
+from storage.ids import new_id
+from storage.locking import FileLock
 
 DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data")
 os.makedirs(DATA_DIR, exist_ok=True)
@@ -9,7 +14,59 @@ DATA_PATH = os.path.join(DATA_DIR, "data.json")
 FILES_DIR = os.path.join(DATA_DIR, "files")
 os.makedirs(FILES_DIR, exist_ok=True)
 
+# "json" rewrites data.json on every save; "journal" appends to data.journal and
+# only rewrites data.json when the journal grows past NOETICA_JOURNAL_COMPACT_BYTES;
+# "sqlite" keeps everything in data.sqlite3 (see storage/sqlite_store.py).
+STORAGE_BACKEND = (os.environ.get("NOETICA_STORAGE_BACKEND") or "json").lower()
+JOURNAL_PATH = os.path.join(DATA_DIR, "data.journal")
+SQLITE_PATH = os.environ.get("NOETICA_SQLITE_PATH") or os.path.join(DATA_DIR, "data.sqlite3")
+JOURNAL_COMPACT_BYTES = int(os.environ.get("NOETICA_JOURNAL_COMPACT_BYTES") or 4 * 1024 * 1024)
+EVENTS_DIR = os.path.join(DATA_DIR, "events")
+EVENTS_SEGMENT_BYTES = int(float(os.environ.get("NOETICA_EVENTS_SEGMENT_MB") or 8) * 1024 * 1024)
+EVENTS_COMPRESS = (os.environ.get("NOETICA_EVENTS_COMPRESS", "true").lower() != "false")
+EVENTS_KEEP_SEGMENTS = int(os.environ.get("NOETICA_EVENTS_KEEP_SEGMENTS") or 0)
+LOCK_PATH = os.path.join(DATA_DIR, ".lock")
+LOCK_TIMEOUT = float(os.environ.get("NOETICA_LOCK_TIMEOUT") or 30)
+SAVE_RETRIES = 5
+
+_COLLECTIONS = ("teachers", "students", "classes", "assignments", "submissions", "enrollments",
+                "quizzes", "questions", "quiz_attempts", "files", "outbox", "teacher_snapshots",
+                "grading_plans", "gradebook_rows")
+SNAPSHOT_TOP_N = 5
+
+# Fields (or tuples of fields) the read helpers look records up by. The JSON store keeps
+# in-memory indexes for them; the SQLite store keeps them as indexed columns.
+_INDEXES: Dict[str, tuple] = {
+    "classes": ("course_code",),
+    "enrollments": ("student_tg_id", "class_id"),
+    "assignments": ("class_id", ("class_id", "posted_message_id")),
+    "submissions": ("assignment_id", "student_tg_id", ("assignment_id", "student_tg_id")),
+    "quizzes": ("class_id",),
+    "questions": ("quiz_id",),
+    "quiz_attempts": ("quiz_id", "student_tg_id", ("student_tg_id", "quiz_id")),
+    "gradebook_rows": ("class_id",),
+}
+
+# _lock serialises threads of this process; _flock serialises the api and bot processes.
 _lock = threading.Lock()
+_flock = FileLock(LOCK_PATH, timeout=LOCK_TIMEOUT)
+_journal = Journal(JOURNAL_PATH)
+# Mutations still append to d["events"]; save() moves them to this log (see storage/events.py).
+_events = EventLog(EVENTS_DIR, EVENTS_SEGMENT_BYTES, EVENTS_COMPRESS, EVENTS_KEEP_SEGMENTS)
+
+# Process-resident copy of the database. Reads are served from memory; data.json is only
+# re-parsed when its stat signature changes, and the journal only re-read past _journal_pos
+# when its size differs from _journal_seen, i.e. when another process (the bot) wrote.
+# _journal_seen also covers a torn tail left by a writer that crashed: it is not a change,
+# and the next append truncates it.
+_doc: Optional[Dict[str, Any]] = None
+_doc_sig: Optional[tuple] = None
+_journal_pos = 0    # end of the last complete record applied
+_journal_seen = 0   # journal size when it was last read
+_indexes: Dict[tuple, "_Index"] = {}   # (collection, field) -> index over the resident document
+_indexed: Optional[Dict[str, Any]] = None   # the document _indexes describe; None while they change
+_pinned = threading.local()            # document pinned by _snapshot() for this thread
+_legacy_events: Optional[List[Dict[str, Any]]] = None   # events found in data.json, moved out on next save
 
 def _now_iso() -> str:
     return datetime.now(timezone.utc).isoformat()
@@ -18,15 +75,249 @@ def _ensure_file():
     if not os.path.exists(DATA_PATH):
         with open(DATA_PATH, "w", encoding="utf-8") as f:
             json.dump({
-                "meta": {"version": 1, "last_updated": _now_iso()},
+                "meta": {"version": 1, "generation": 0, "last_updated": _now_iso()},
                 "teachers": {}, "students": {}, "classes": {}, "assignments": {}, 
-                "submissions": {}, "enrollments": {}, "events": []
+                "submissions": {}, "enrollments": {}
             }, f, ensure_ascii=False, indent=2)
 
-def load() -> Dict[str, Any]:
+def _file_sig() -> tuple:
+    st = os.stat(DATA_PATH)
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+class _Collection:
+    """
+    Write view of one collection that remembers every key a mutation reaches.
+    Records must be reached by key (d[name][key], .get(key)) for changes to be journaled;
+    iterating .values() is fine for reading. Unless the records are already private to
+    the mutation (private=True), a record is deep-copied the first time it is reached by
+    key, so changing it in place never shows through to the document it came from.
+    """
+    __slots__ = ("name", "data", "touched", "owned")
+
+    def __init__(self, name: str, data: Dict[str, Any], touched: Dict[tuple, None], private: bool = False):
+        self.name, self.data, self.touched = name, data, touched
+        self.owned = None if private else set()   # keys whose record is the mutation's own copy
+
+    def _own(self, key):
+        if self.owned is not None and key not in self.owned:
+            self.owned.add(key)
+            if key in self.data:
+                self.data[key] = copy.deepcopy(self.data[key])
+
+    def __getitem__(self, key):
+        self.touched[(self.name, key)] = None
+        self._own(key)
+        return self.data[key]
+
+    def __setitem__(self, key, value):
+        self.touched[(self.name, key)] = None
+        if self.owned is not None:
+            self.owned.add(key)
+        self.data[key] = value
+
+    def __delitem__(self, key):
+        self.touched[(self.name, key)] = None
+        del self.data[key]
+
+    def get(self, key, default=None):
+        if key in self.data:
+            self.touched[(self.name, key)] = None
+            self._own(key)
+        return self.data.get(key, default)
+
+    def pop(self, key, *default):
+        self.touched[(self.name, key)] = None
+        self._own(key)
+        return self.data.pop(key, *default)
+
+    def __contains__(self, key): return key in self.data
+    def __iter__(self): return iter(self.data)
+    def __len__(self): return len(self.data)
+    def keys(self): return self.data.keys()
+    def values(self): return self.data.values()
+    def items(self): return self.data.items()
+
+class _Tracked:
+    """
+    Document view handed to save() mutations. Collections are copied on first access, and
+    their records on first access by key (see _Collection), so readers of the resident
+    document are never disturbed (and a mutation that raises leaves it untouched); touched
+    keys are recorded for the journal and new events buffered for the event log.
+    """
+    def __init__(self, base: Dict[str, Any]):
+        self.base = base
+        self.doc = dict(base)
+        self.doc["meta"] = dict(base["meta"])
+        self.touched: Dict[tuple, None] = {}
+        self.events: List[Dict[str, Any]] = []
+        self._views: Dict[str, _Collection] = {}
+
+    def __getitem__(self, name):
+        if name == "events":
+            return self.events
+        if name == "meta":
+            return self.doc["meta"]
+        view = self._views.get(name)
+        if view is None:
+            self.doc[name] = dict(self.base.get(name, {}))
+            view = self._views[name] = _Collection(name, self.doc[name], self.touched)
+        return view
+
+    def __setitem__(self, name, value):
+        self.doc[name] = dict(value)
+        self._views.pop(name, None)
+        self.touched.update(((name, k), None) for k in value)
+
+    def __contains__(self, name): return name == "events" or name in self.doc
+
+    def changes(self) -> List[list]:
+        ops = []
+        for name, key in self.touched:
+            coll = self.doc[name]
+            ops.append(["put", name, key, coll[key]] if key in coll else ["del", name, key])
+        return ops
+
+    def commit(self) -> Dict[str, Any]:
+        return self.doc
+
+_MISSING = object()
+
+class _Index:
+    """Secondary index: field value -> keys of the records holding it, in insertion order."""
+    __slots__ = ("field", "buckets", "values")
+
+    def __init__(self, field):
+        self.field = field
+        self.buckets: Dict[Any, Dict[str, None]] = {}
+        self.values: Dict[str, Any] = {}   # record key -> value it is filed under
+
+    def update(self, key: str, rec: Optional[Dict[str, Any]]):
+        old = self.values.get(key, _MISSING)
+        if rec is None:
+            new = _MISSING
+        elif isinstance(self.field, tuple):
+            new = tuple(rec.get(f) for f in self.field)
+        else:
+            new = rec.get(self.field)
+        if old is not _MISSING and new is not _MISSING and old == new:
+            return
+        if old is not _MISSING:
+            bucket = self.buckets[old]
+            bucket.pop(key, None)
+            if not bucket:
+                del self.buckets[old]
+            del self.values[key]
+        if new is not _MISSING:
+            self.buckets.setdefault(new, {})[key] = None
+            self.values[key] = new
+
+def _build_indexes(doc: Dict[str, Any]):
+    global _indexes, _indexed
+    _indexed = None
+    indexes = {}
+    for name, fields in _INDEXES.items():
+        for field in fields:
+            idx = indexes[(name, field)] = _Index(field)
+            for key, rec in doc.get(name, {}).items():
+                idx.update(key, rec)
+    _indexes = indexes
+    _indexed = doc
+
+def _reindex(doc: Dict[str, Any], touched: Dict[tuple, None]):
+    """Bring the indexes up to date with the records a mutation touched."""
+    global _indexed
+    _indexed = None
+    for name, key in touched:
+        for field in _INDEXES.get(name, ()):
+            _indexes[(name, field)].update(key, doc[name].get(key))
+    _indexed = doc
+
+def _apply(t: _Tracked, records: List[Dict[str, Any]]):
+    for rec in records:
+        if rec["gen"] <= t["meta"].get("generation", 0):
+            continue  # already folded into the snapshot
+        for op in rec["ops"]:
+            if op[0] == "put":
+                t[op[1]][op[2]] = op[3]
+            elif op[0] == "del":
+                t[op[1]].pop(op[2], None)
+            elif op[0] == "ev":
+                t["events"].append(op[1])   # written before events had their own log
+        t["meta"].update(rec["meta"])
+
+def _replay(base: Dict[str, Any], records: List[Dict[str, Any]]) -> Dict[str, Any]:
+    t = _Tracked(base)
+    _apply(t, records)
+    doc = t.commit()
+    if t.events:
+        doc["events"] = base.get("events", []) + t.events
+    return doc
+
+def _refresh() -> Dict[str, Any]:
+    """Bring the resident document up to date with disk. Caller must hold _lock."""
+    global _doc, _doc_sig, _journal_pos, _journal_seen, _legacy_events
     _ensure_file()
+    sig = _file_sig()
+    size = _journal.size()
+    if _doc is not None and sig == _doc_sig:
+        if size == _journal_seen:
+            return _doc
+        if size > _journal_pos:
+            # Another process appended: replay only the tail.
+            records, _journal_pos = _journal.read(_journal_pos)
+            _journal_seen = max(size, _journal_pos)
+            if records:
+                t = _Tracked(_doc)
+                _apply(t, records)
+                _doc = t.commit()
+                _reindex(_doc, t.touched)
+            return _doc
     with open(DATA_PATH, "r", encoding="utf-8") as f:
-        return json.load(f)
+        doc = _upgrade(json.load(f))
+    records, _journal_pos = _journal.read(0)
+    _journal_seen = max(size, _journal_pos)
+    _doc, _doc_sig = (_replay(doc, records) if records else doc), sig
+    _legacy_events = _doc.pop("events", None)
+    _build_indexes(_doc)
+    return _doc
+
+def _stale() -> bool:
+    """True if another process wrote since the resident document was read."""
+    return (_doc is None or not os.path.exists(DATA_PATH) or _file_sig() != _doc_sig
+            or _journal.size() != _journal_seen)
+
+def _upgrade(doc: Dict[str, Any]) -> Dict[str, Any]:
+    """Fill in collections and fields added since a data.json was written."""
+    if "files" not in doc:
+        doc["files"] = {s["file"]["file_id"]: _file_record(s) for s in doc.get("submissions", {}).values()
+                        if s.get("file") and s["file"].get("file_id")}
+    if "teacher_snapshots" not in doc:
+        doc["teacher_snapshots"] = _build_teacher_snapshots(doc)
+    if "gradebook_rows" not in doc:
+        doc["gradebook_rows"] = _build_gradebook_rows(doc)
+    for name in _COLLECTIONS:
+        doc.setdefault(name, {})
+    doc["meta"].setdefault("generation", 0)
+    return doc
+
+def load() -> Dict[str, Any]:
+    """
+    Return the resident database document.
+
+    The dict is shared by every reader in the process: treat it as read-only and
+    go through save() for changes. With the SQLite backend this materialises the whole
+    database, so prefer the storage functions for anything on a request path.
+    """
+    if _sql:
+        return _sql.export()
+    doc = getattr(_pinned, "doc", None)
+    if doc is not None:
+        return doc
+    doc = _doc
+    if _stale():
+        with _lock:
+            doc = _refresh()
+    return doc
 
 def _atomic_write(obj: Dict[str, Any]):
     tmp_fd, tmp_path = tempfile.mkstemp(prefix="data_", suffix=".json", dir=DATA_DIR)
@@ -39,19 +330,136 @@ def _atomic_write(obj: Dict[str, Any]):
         try: os.remove(tmp_path)
         except FileNotFoundError: pass
 
+def _compact(data: Dict[str, Any]):
+    """Write a full snapshot and drop the journal records it now contains. Caller holds _lock."""
+    global _doc_sig, _journal_pos, _journal_seen
+    _atomic_write(data)
+    _doc_sig = _file_sig()
+    if _journal_seen:
+        _journal.reset(data["meta"]["generation"])
+        _journal_pos = _journal_seen = 0
+
 def save(mutate_fn):
-    with _lock:
-        data = load()
-        res = mutate_fn(data)
-        data["meta"]["last_updated"] = _now_iso()
-        _atomic_write(data)
-        return res
+    global _doc, _journal_pos, _journal_seen, _legacy_events
+    if _sql:
+        return _sql.save(mutate_fn)
+    with _lock, _flock:
+        for attempt in range(SAVE_RETRIES):
+            t = _Tracked(_refresh())
+            # Reads inside the mutation (_get/_find) see the version it started from,
+            # served from memory without re-taking _lock.
+            pinned, _pinned.doc = getattr(_pinned, "doc", None), t.base
+            try:
+                res = mutate_fn(t)
+            finally:
+                _pinned.doc = pinned
+            # Optimistic check: holding the file lock, nothing should have changed since
+            # _refresh(). If a writer that bypasses the lock got in, redo on its version.
+            if not _stale():
+                break
+            _flock._record(conflicts=1)
+            time.sleep(min(0.005 * 2 ** attempt, 0.2))
+        else:
+            raise RuntimeError("Database kept changing during save(); giving up")
+        meta = t["meta"]
+        meta["last_updated"] = _now_iso()
+        meta["generation"] = gen = meta.get("generation", 0) + 1
+        data = t.commit()
+        moved = bool(_legacy_events)
+        if moved:
+            # data.json still carries the pre-event-log history: move it out with this save.
+            _events.append(_legacy_events)
+            _legacy_events = None
+        if STORAGE_BACKEND == "journal":
+            _journal_pos = _journal.append({"gen": gen, "meta": {"generation": gen, "last_updated": meta["last_updated"]},
+                                            "ops": t.changes()}, at=_journal_pos)
+            _journal_seen = _journal_pos
+            if _journal_pos >= JOURNAL_COMPACT_BYTES or moved:
+                _compact(data)
+        else:
+            _compact(data)
+        _doc = data
+        _reindex(data, t.touched)
+        _events.append(t.events)
+    if STORAGE_BACKEND == "journal":
+        # Outside the lock, so saves from other threads batch into the same fsync.
+        _journal.sync(gen)
+    return res
+
+def read_events(cursor: Optional[str] = None, limit: int = 1000):
+    """Tail the event log: up to `limit` events after `cursor`, and the cursor to continue from."""
+    return _events.read(cursor, limit)
+
+def lock_stats() -> Dict[str, Any]:
+    """Lock wait and write-conflict counters for this process."""
+    return {"backend": STORAGE_BACKEND, **_flock.stats()}
+
+# Imported last: the SQLite store builds on the helpers above.
+if STORAGE_BACKEND == "sqlite":
+    from storage import sqlite_store as _sql
+else:
+    _sql = None
+    if os.path.exists(SQLITE_PATH):
+        # Most likely NOETICA_STORAGE_BACKEND did not reach this process: another one may
+        # be writing the SQLite database, and this one would write data.json beside it.
+        raise RuntimeError(f"Storage backend is {STORAGE_BACKEND!r} but {SQLITE_PATH} exists; "
+                           "set NOETICA_STORAGE_BACKEND=sqlite for every process, or move the "
+                           "database aside to go back to data.json")
+
+# --- READS ---
+# The storage functions read through these so every backend can serve them.
+@contextmanager
+def _snapshot():
+    """
+    Serve every read in the block from one consistent version of the database. Lookups
+    use the indexes only while they still describe the pinned version (see _find).
+    """
+    if _sql:
+        with _sql.read_transaction():
+            yield
+        return
+    if getattr(_pinned, "doc", None) is not None:
+        yield
+        return
+    _pinned.doc = load()
+    try:
+        yield
+    finally:
+        _pinned.doc = None
+
+def _get(name: str, key: str) -> Optional[Dict[str, Any]]:
+    if _sql:
+        return _sql.get(name, key)
+    return load().get(name, {}).get(key)
+
+def _find(name: str, field, value) -> List[Dict[str, Any]]:
+    """Records of `name` whose `field` equals `value`; a tuple of fields matches a tuple of values."""
+    if _sql:
+        return _sql.find(name, field, value)
+    doc = load()
+    records = doc.get(name, {})
+    idx = _indexes.get((name, field))
+    # The indexes follow the resident document: a document pinned before the last save,
+    # or one whose indexes are being updated, is scanned instead.
+    if idx is not None and doc is _indexed:
+        keys = list(idx.buckets.get(value, ()))
+        if doc is _indexed:
+            return [records[k] for k in keys if k in records]
+    records = records.values()
+    if isinstance(field, tuple):
+        return [r for r in records if tuple(r.get(f) for f in field) == value]
+    return [r for r in records if r.get(field) == value]
+
+def _all(name: str) -> List[Dict[str, Any]]:
+    if _sql:
+        return _sql.all(name)
+    return list(load().get(name, {}).values())
 
 def make_assignment_id() -> str:
-    return "A" + str(int(time.time()))
+    return new_id("A")
 
 def make_submission_id() -> str:
-    return "S" + str(int(time.time()*1000))
+    return new_id("S")
 
 def make_course_code() -> str:
     """Generate a unique course code for enrollment"""
@@ -59,27 +467,36 @@ def make_course_code() -> str:
 
 # --- TEACHERS ---
 def ensure_teacher(tg_user_id: int, name: str) -> Dict[str, Any]:
+    existing = _get("teachers", str(tg_user_id))
+    if existing:
+        return existing
     def mut(d):
         key = str(tg_user_id)
         if key not in d["teachers"]:
             d["teachers"][key] = {"tg_user_id": tg_user_id, "name": name, "created_at": _now_iso()}
-            d["events"].append({"id": f"E{time.time_ns()}", "type":"teacher_created","actor":tg_user_id,"payload":{"name":name},"ts":_now_iso()})
+            d["events"].append({"id": new_id("E"), "type":"teacher_created","actor":tg_user_id,"payload":{"name":name},"ts":_now_iso()})
         return d["teachers"][key]
     return save(mut)
 
+def get_teacher(tg_user_id: int) -> Optional[Dict[str, Any]]:
+    return _get("teachers", str(tg_user_id))
+
 # --- STUDENTS ---
 def ensure_student(tg_user_id: int, name: str = None) -> Dict[str, Any]:
+    existing = _get("students", str(tg_user_id))
+    if existing:
+        return existing
     def mut(d):
         key = str(tg_user_id)
         if key not in d["students"]:
             student_name = name or f"Student {tg_user_id}"
             d["students"][key] = {"tg_user_id": tg_user_id, "name": student_name, "created_at": _now_iso()}
-            d["events"].append({"id": f"E{time.time_ns()}", "type":"student_created","actor":tg_user_id,"payload":{"name":student_name},"ts":_now_iso()})
+            d["events"].append({"id": new_id("E"), "type":"student_created","actor":tg_user_id,"payload":{"name":student_name},"ts":_now_iso()})
         return d["students"][key]
     return save(mut)
 
 def get_student(tg_user_id: int) -> Optional[Dict[str, Any]]:
-    return load()["students"].get(str(tg_user_id))
+    return _get("students", str(tg_user_id))
 
 # --- CLASSES ---
 def link_class(group_chat_id: int, group_title: str, teacher_tg_id: int) -> Dict[str, Any]:
@@ -87,6 +504,12 @@ def link_class(group_chat_id: int, group_title: str, teacher_tg_id: int) -> Dict
         gid = str(group_chat_id)
         # Generate a unique course code for enrollment
         course_code = make_course_code()
+        previous = d["classes"].get(gid)
+        if previous and previous["teacher_tg_id"] != teacher_tg_id:
+            old = _teacher_view(d, previous["teacher_tg_id"])
+            old["classes"].pop(gid, None)
+        view = _teacher_view(d, teacher_tg_id)
+        view["classes"][gid] = {"title": group_title, "students": view["classes"].get(gid, {}).get("students", 0)}
         d["classes"][gid] = {
             "class_id": gid, 
             "title": group_title, 
@@ -94,20 +517,18 @@ def link_class(group_chat_id: int, group_title: str, teacher_tg_id: int) -> Dict
             "course_code": course_code,
             "created_at": _now_iso()
         }
-        d["events"].append({"id": f"E{time.time_ns()}","type":"class_linked","actor":teacher_tg_id,
+        d["events"].append({"id": new_id("E"),"type":"class_linked","actor":teacher_tg_id,
                             "payload":{"group_chat_id":group_chat_id,"title":group_title},"ts":_now_iso()})
         return d["classes"][gid]
     return save(mut)
 
 def get_class(group_chat_id: int) -> Optional[Dict[str, Any]]:
-    return load()["classes"].get(str(group_chat_id))
+    return _get("classes", str(group_chat_id))
 
 def get_course_by_code(course_code: str) -> Optional[Dict[str, Any]]:
     """Find a class by its enrollment code"""
-    for cls in load()["classes"].values():
-        if cls.get("course_code") == course_code:
-            return cls
-    return None
+    found = _find("classes", "course_code", course_code)
+    return found[0] if found else None
 
 # --- ENROLLMENTS ---
 def enroll_student(student_tg_id: int, class_id: str) -> Dict[str, Any]:
@@ -120,6 +541,11 @@ def enroll_student(student_tg_id: int, class_id: str) -> Dict[str, Any]:
         if enrollment_id in d["enrollments"]:
             return d["enrollments"][enrollment_id]
         
+        cls = d["classes"].get(class_id)
+        if cls:
+            entry = _teacher_view(d, cls["teacher_tg_id"])["classes"].setdefault(class_id, {"title": cls["title"], "students": 0})
+            entry["students"] += 1
+        
         # Create enrollment record
         d["enrollments"][enrollment_id] = {
             "enrollment_id": enrollment_id,
@@ -127,10 +553,11 @@ def enroll_student(student_tg_id: int, class_id: str) -> Dict[str, Any]:
             "class_id": class_id,
             "enrolled_at": _now_iso()
         }
+        _gradebook_row(d, class_id, student_tg_id)
         
         # Add event
         d["events"].append({
-            "id": f"E{time.time_ns()}",
+            "id": new_id("E"),
             "type": "student_enrolled",
             "actor": student_tg_id,
             "payload": {"class_id": class_id},
@@ -143,22 +570,20 @@ def enroll_student(student_tg_id: int, class_id: str) -> Dict[str, Any]:
 def is_student_enrolled(student_tg_id: int, class_id: str) -> bool:
     """Check if a student is enrolled in a class"""
     enrollment_id = f"E{student_tg_id}_{class_id}"
-    return enrollment_id in load()["enrollments"]
+    return _get("enrollments", enrollment_id) is not None
 
 def get_student_courses(student_tg_id: int) -> List[Dict[str, Any]]:
     """Get all courses a student is enrolled in"""
-    data = load()
-    enrollments = [e for e in data["enrollments"].values() if e["student_tg_id"] == student_tg_id]
+    enrollments = _find("enrollments", "student_tg_id", student_tg_id)
     
     result = []
     for enrollment in enrollments:
         class_id = enrollment["class_id"]
-        if class_id in data["classes"]:
-            cls = data["classes"][class_id]
+        cls = _get("classes", class_id)
+        if cls:
             # Get teacher name
-            teacher_name = "Unknown"
-            if str(cls["teacher_tg_id"]) in data["teachers"]:
-                teacher_name = data["teachers"][str(cls["teacher_tg_id"])]["name"]
+            teacher = _get("teachers", str(cls["teacher_tg_id"]))
+            teacher_name = teacher["name"] if teacher else "Unknown"
             
             result.append({
                 "course_id": class_id,
@@ -170,6 +595,19 @@ def get_student_courses(student_tg_id: int) -> List[Dict[str, Any]]:
     
     return result
 
+def get_student_dashboard(student_tg_id: int) -> List[Dict[str, Any]]:
+    """
+    A student's courses, each with its assignments marked submitted or not,
+    read from a single snapshot with one lookup per course.
+    """
+    with _snapshot():
+        submitted = {s["assignment_id"] for s in _find("submissions", "student_tg_id", student_tg_id)}
+        courses = get_student_courses(student_tg_id)
+        for course in courses:
+            course["assignments"] = [{**a, "submitted": a["assignment_id"] in submitted}
+                                     for a in _find("assignments", "class_id", course["course_id"])]
+    return courses
+
 # --- ASSIGNMENTS ---
 def create_assignment(class_id: str, title: str, instructions_md: str, due_at: Optional[str]) -> Dict[str, Any]:
     aid = make_assignment_id()
@@ -179,7 +617,10 @@ def create_assignment(class_id: str, title: str, instructions_md: str, due_at: O
             "instructions_md": instructions_md or "", "due_at": due_at,
             "posted_message_id": None, "status":"open", "created_at": _now_iso(), "updated_at": _now_iso()
         }
-        d["events"].append({"id": f"E{time.time_ns()}","type":"assignment_created","actor":d["classes"][class_id]["teacher_tg_id"],
+        view = _teacher_view(d, d["classes"][class_id]["teacher_tg_id"])
+        view["assignment_count"] += 1
+        _push_recent(view, d["assignments"][aid])
+        d["events"].append({"id": new_id("E"),"type":"assignment_created","actor":d["classes"][class_id]["teacher_tg_id"],
                             "payload":{"assignment_id":aid}, "ts":_now_iso()})
         return d["assignments"][aid]
     return save(mut)
@@ -193,14 +634,19 @@ def set_assignment_message_id(assignment_id: str, msg_id: int):
     return save(mut)
 
 def list_assignments(class_id: str) -> List[Dict[str, Any]]:
-    return [a for a in load()["assignments"].values() if a["class_id"] == class_id]
+    return _find("assignments", "class_id", class_id)
+
+def find_assignment_by_message(class_id: str, message_id: int) -> Optional[Dict[str, Any]]:
+    """The assignment whose group post is `message_id` in the class chat, if any."""
+    found = _find("assignments", ("class_id", "posted_message_id"), (class_id, message_id))
+    return found[0] if found else None
 
 def list_course_assignments(class_id: str) -> List[Dict[str, Any]]:
     """Alias for list_assignments to maintain consistent naming"""
     return list_assignments(class_id)
 
 def get_assignment(aid: str) -> Optional[Dict[str, Any]]:
-    return load()["assignments"].get(aid)
+    return _get("assignments", aid)
 
 def update_assignment(aid: str, **updates) -> Optional[Dict[str, Any]]:
     def mut(d):
@@ -208,7 +654,10 @@ def update_assignment(aid: str, **updates) -> Optional[Dict[str, Any]]:
             return None
         d["assignments"][aid].update({k:v for k,v in updates.items() if v is not None})
         d["assignments"][aid]["updated_at"] = _now_iso()
-        d["events"].append({"id": f"E{time.time_ns()}","type":"assignment_updated",
+        entry = _recent_entry(d, d["assignments"][aid]["class_id"], aid)
+        if entry:
+            entry.update(title=d["assignments"][aid]["title"], due_at=d["assignments"][aid].get("due_at"))
+        d["events"].append({"id": new_id("E"),"type":"assignment_updated",
                             "actor": d["classes"][d["assignments"][aid]["class_id"]]["teacher_tg_id"],
                             "payload":{"assignment_id":aid,"updates":list(updates.keys())}, "ts":_now_iso()})
         return d["assignments"][aid]
@@ -231,47 +680,222 @@ def add_submission(assignment_id: str, student_tg_id: int, student_name: str,
             "student_name": student_name, "ts": _now_iso(), "late": late,
             "text": text, "file": file_meta, "message_id": message_id
         }
-        d["events"].append({"id": f"E{time.time_ns()}","type":"submission_added","actor":student_tg_id,
+        if file_meta and file_meta.get("file_id"):
+            d["files"][file_meta["file_id"]] = _file_record(d["submissions"][sid])
+        class_id = d["assignments"].get(assignment_id, {}).get("class_id")
+        entry = _recent_entry(d, class_id, assignment_id)
+        if entry:
+            entry["submitters"][str(student_tg_id)] = late
+        if class_id:
+            row = _gradebook_row(d, class_id, student_tg_id, student_name)
+            row["cells"][assignment_id] = {"status": "late" if late else "on_time", "ts": d["submissions"][sid]["ts"]}
+            _tally(row)
+        d["events"].append({"id": new_id("E"),"type":"submission_added","actor":student_tg_id,
                             "payload":{"assignment_id":assignment_id,"submission_id":sid}, "ts":_now_iso()})
         return d["submissions"][sid]
     return save(mut)
 
+def _file_record(submission: Dict[str, Any]) -> Dict[str, Any]:
+    """Entry of the file_id -> metadata index kept alongside the submission."""
+    return {**submission["file"], "submission_id": submission["submission_id"],
+            "assignment_id": submission["assignment_id"], "student_tg_id": submission["student_tg_id"]}
+
+def get_file_meta(file_id: str) -> Optional[Dict[str, Any]]:
+    """Metadata of a submitted file (filename, mime, size, local_path, owning submission)"""
+    return _get("files", file_id)
+
+def update_file_meta(file_id: str, **updates) -> Optional[Dict[str, Any]]:
+    """Update a stored file's metadata in the file index and in its submission"""
+    def mut(d):
+        if file_id not in d["files"]:
+            return None
+        d["files"][file_id].update(updates)
+        sub = d["submissions"].get(d["files"][file_id]["submission_id"])
+        if sub and sub.get("file"):
+            sub["file"].update(updates)
+        return d["files"][file_id]
+    return save(mut)
+
 def list_submissions(assignment_id: str) -> List[Dict[str, Any]]:
-    return [s for s in load()["submissions"].values() if s["assignment_id"] == assignment_id]
+    return _find("submissions", "assignment_id", assignment_id)
 
 def has_student_submitted(assignment_id: str, student_tg_id: int) -> bool:
     """Check if a student has submitted an assignment"""
-    return any(s["student_tg_id"] == student_tg_id for s in list_submissions(assignment_id))
+    return bool(_find("submissions", ("assignment_id", "student_tg_id"), (assignment_id, student_tg_id)))
 
 def get_student_submission(assignment_id: str, student_tg_id: int) -> Optional[Dict[str, Any]]:
     """Get a student's submission for an assignment"""
-    submissions = [s for s in list_submissions(assignment_id) if s["student_tg_id"] == student_tg_id]
+    submissions = _find("submissions", ("assignment_id", "student_tg_id"), (assignment_id, student_tg_id))
     if submissions:
         # Return the most recent submission if multiple exist
         return max(submissions, key=lambda s: s["ts"])
     return None
 
-def export_submissions_csv(assignment_id: str) -> str:
-    rows = list_submissions(assignment_id)
-    out_path = os.path.join(FILES_DIR, f"export_{assignment_id}.csv")
-    with open(out_path, "w", newline="", encoding="utf-8") as f:
-        w = csv.writer(f)
-        w.writerow(["submission_id","student_tg_id","student_name","ts","late","has_file","local_path","text"])
-        for s in rows:
+# --- EXPORTS ---
+# CSV exports are generators of text lines, so they can be streamed to the client as
+# they are produced instead of being written to a file first.
+def _csv_line(row: List[Any]) -> str:
+    buf = io.StringIO()
+    csv.writer(buf).writerow(row)
+    return buf.getvalue()
+
+def iter_submissions_csv(assignment_ids: Iterable[str]) -> Iterator[str]:
+    """CSV lines of every submission to the given assignments, one assignment at a time."""
+    yield _csv_line(["assignment_id","submission_id","student_tg_id","student_name","ts","late","has_file","local_path","text"])
+    for assignment_id in assignment_ids:
+        for s in list_submissions(assignment_id):
             has_file = bool(s.get("file"))
             local_path = (s["file"] or {}).get("local_path","")
-            w.writerow([s["submission_id"], s["student_tg_id"], s["student_name"], s["ts"], s["late"], has_file, local_path, (s.get("text") or "").replace("\n"," ")])
-    return out_path
-
-# --- SNAPSHOT TEXT ---
-def build_snapshot_text() -> str:
-    d = load()
-    classes = d["classes"]; assignments = d["assignments"]
-    latest = sorted(assignments.values(), key=lambda x: x.get("created_at",""), reverse=True)[:5]
+            yield _csv_line([assignment_id, s["submission_id"], s["student_tg_id"], s["student_name"], s["ts"], s["late"], has_file, local_path, (s.get("text") or "").replace("\n"," ")])
+
+def iter_gradebook_csv(class_id: str) -> Iterator[str]:
+    """CSV lines of a class gradebook (see get_gradebook), one row per student."""
+    book = get_gradebook(class_id)
+    items = book["items"]
+    yield _csv_line(["student_tg_id", "student_name"] + [f"{i['title']} ({i['item_id']})" for i in items]
+                    + ["submitted", "late"])
+    for row in book["rows"]:
+        cells = [row["cells"].get(i["item_id"], {}) for i in items]
+        yield _csv_line([row["student_tg_id"], row["student_name"]]
+                        + [c.get("status", "") if i["kind"] == "assignment" else c.get("best_score", "")
+                           for i, c in zip(items, cells)]
+                        + [row["submitted"], row["late"]])
+
+# --- TEACHER SNAPSHOTS ---
+# Each teacher's snapshot view is kept up to date by the mutations above (link, enroll,
+# create, update, submit), so rendering it never scans the database. It holds the
+# teacher's classes with their enrolment counts and the SNAPSHOT_TOP_N most recent
+# assignments, each with the students who submitted (and whether late).
+def _empty_view(teacher_tg_id: int) -> Dict[str, Any]:
+    return {"teacher_tg_id": teacher_tg_id, "classes": {}, "assignment_count": 0, "recent": []}
+
+def _teacher_view(d, teacher_tg_id: int) -> Dict[str, Any]:
+    """The teacher's view, writable in place (the mutation's own copy)."""
+    key = str(teacher_tg_id)
+    view = d["teacher_snapshots"].get(key) or _empty_view(teacher_tg_id)
+    d["teacher_snapshots"][key] = view
+    return view
+
+def _recent_entry(d, class_id: Optional[str], aid: str) -> Optional[Dict[str, Any]]:
+    """Writable entry for `aid` if it is among its teacher's recent assignments, else None."""
+    cls = d["classes"].data.get(class_id)
+    # Peek through .data so the common case (an older assignment) leaves the view untouched.
+    view = cls and d["teacher_snapshots"].data.get(str(cls["teacher_tg_id"]))
+    if not view or not any(e["assignment_id"] == aid for e in view["recent"]):
+        return None
+    return next(e for e in _teacher_view(d, cls["teacher_tg_id"])["recent"] if e["assignment_id"] == aid)
+
+def _push_recent(view: Dict[str, Any], a: Dict[str, Any]):
+    entry = {"assignment_id": a["assignment_id"], "title": a["title"], "class_id": a["class_id"],
+             "due_at": a.get("due_at"), "created_at": a.get("created_at", ""), "submitters": {}}
+    view["recent"] = heapq.nlargest(SNAPSHOT_TOP_N, view["recent"] + [entry],
+                                    key=lambda e: (e["created_at"], e["assignment_id"]))
+
+def _build_teacher_snapshots(doc: Dict[str, Any]) -> Dict[str, Any]:
+    """Derive every teacher's view from scratch (for data written before views existed)."""
+    views: Dict[str, Any] = {}
+    classes = doc.get("classes", {})
+    def view_of(class_id):
+        cls = classes.get(class_id)
+        if not cls:
+            return None
+        return views.setdefault(str(cls["teacher_tg_id"]), _empty_view(cls["teacher_tg_id"]))
+    for gid, cls in classes.items():
+        view_of(gid)["classes"][gid] = {"title": cls["title"], "students": 0}
+    for e in doc.get("enrollments", {}).values():
+        if view_of(e["class_id"]):
+            view_of(e["class_id"])["classes"][e["class_id"]]["students"] += 1
+    for a in doc.get("assignments", {}).values():
+        view = view_of(a["class_id"])
+        if view:
+            view["assignment_count"] += 1
+            _push_recent(view, a)
+    recent = {e["assignment_id"]: e for v in views.values() for e in v["recent"]}
+    for s in sorted(doc.get("submissions", {}).values(), key=lambda s: s.get("ts", "")):
+        if s["assignment_id"] in recent:
+            recent[s["assignment_id"]]["submitters"][str(s["student_tg_id"])] = s.get("late", False)
+    return views
+
+def build_snapshot_text(teacher_tg_id: int) -> str:
+    view = _get("teacher_snapshots", str(teacher_tg_id)) or _empty_view(teacher_tg_id)
     lines = [
         f"🔔 LMS Snapshot — {datetime.utcnow().strftime('%Y-%m-%d %H:%M UTC')}",
-        f"Classes: {len(classes)} | Assignments: {len(assignments)}"
+        f"Classes: {len(view['classes'])} | Assignments: {view['assignment_count']}"
     ]
-    for a in latest:
-        lines.append(f"- {a['assignment_id']}: {a['title']} (class {a['class_id']}) due:{a.get('due_at','-')}")
-    return "\n".join(lines)
\ No newline at end of file
+    for e in view["recent"]:
+        cls = view["classes"].get(e["class_id"], {})
+        submitted = len(e["submitters"])
+        late = sum(1 for v in e["submitters"].values() if v)
+        pending = max(cls.get("students", 0) - submitted, 0)
+        lines.append(f"- {e['assignment_id']}: {e['title']} ({cls.get('title', 'class ' + e['class_id'])}) due:{e.get('due_at') or '-'}"
+                     f" — submitted {submitted}, pending {pending}, late {late}")
+    return "\n".join(lines)
+
+# --- GRADEBOOK ---
+# One row per (class, student) in 'gradebook_rows', kept up to date by enrolment,
+# add_submission and quiz completion/regrading, so a class gradebook is read from its
+# rows alone. Cells are keyed by item id: {"status": "on_time"|"late", "ts"} for an
+# assignment (its latest submission) and {"best_score", "attempts"} for a quiz.
+def _empty_row(class_id: str, student_tg_id: int, name: str) -> Dict[str, Any]:
+    return {"class_id": class_id, "student_tg_id": student_tg_id, "student_name": name,
+            "cells": {}, "submitted": 0, "late": 0}
+
+def _gradebook_row(d, class_id: str, student_tg_id: int, name: Optional[str] = None) -> Dict[str, Any]:
+    """The student's row in the class, writable in place (the mutation's own copy)."""
+    key = f"{class_id}:{student_tg_id}"
+    row = d["gradebook_rows"].get(key)
+    if not row:
+        student = d["students"].data.get(str(student_tg_id))
+        row = _empty_row(class_id, student_tg_id, (student or {}).get("name") or name or f"Student {student_tg_id}")
+    d["gradebook_rows"][key] = row
+    return row
+
+def _tally(row: Dict[str, Any]):
+    statuses = [c["status"] for c in row["cells"].values() if "status" in c]
+    row["submitted"], row["late"] = len(statuses), statuses.count("late")
+
+def _quiz_cell(scores: List[int]) -> Dict[str, Any]:
+    return {"best_score": max(scores), "attempts": len(scores)}
+
+def get_gradebook(class_id: str, offset: int = 0, limit: Optional[int] = None) -> Dict[str, Any]:
+    """
+    The class's items (its assignments, then its non-draft quizzes) and a page of student
+    rows ordered by name.
+    """
+    with _snapshot():
+        rows = sorted(_find("gradebook_rows", "class_id", class_id),
+                      key=lambda r: (r["student_name"].lower(), r["student_tg_id"]))
+        items = [{"item_id": a["assignment_id"], "kind": "assignment", "title": a["title"], "due_at": a.get("due_at")}
+                 for a in _find("assignments", "class_id", class_id)]
+        items += [{"item_id": q["quiz_id"], "kind": "quiz", "title": q["title"], "due_at": q.get("due_at")}
+                  for q in _find("quizzes", "class_id", class_id) if q.get("status") != "draft"]
+    page = rows[offset:offset + limit] if limit is not None else rows[offset:]
+    return {"class_id": class_id, "items": items, "total": len(rows), "offset": offset, "rows": page}
+
+def _build_gradebook_rows(doc: Dict[str, Any]) -> Dict[str, Any]:
+    """Derive every gradebook row from scratch (for data written before the gradebook existed)."""
+    rows: Dict[str, Any] = {}
+    names = {k: s.get("name") for k, s in doc.get("students", {}).items()}
+    def row_of(class_id, student_tg_id, name=None):
+        key = f"{class_id}:{student_tg_id}"
+        if key not in rows:
+            rows[key] = _empty_row(class_id, student_tg_id, names.get(str(student_tg_id)) or name or f"Student {student_tg_id}")
+        return rows[key]
+    for e in doc.get("enrollments", {}).values():
+        row_of(e["class_id"], e["student_tg_id"])
+    assignments = doc.get("assignments", {})
+    for s in sorted(doc.get("submissions", {}).values(), key=lambda s: s.get("ts", "")):
+        a = assignments.get(s["assignment_id"])
+        if a:
+            row_of(a["class_id"], s["student_tg_id"], s.get("student_name"))["cells"][s["assignment_id"]] = {
+                "status": "late" if s.get("late") else "on_time", "ts": s.get("ts")}
+    quizzes = doc.get("quizzes", {})
+    scores: Dict[tuple, List[int]] = {}
+    for at in doc.get("quiz_attempts", {}).values():
+        if at.get("status") == "completed" and at.get("score") is not None and at["quiz_id"] in quizzes:
+            scores.setdefault((quizzes[at["quiz_id"]]["class_id"], at["student_tg_id"], at["quiz_id"]), []).append(at["score"])
+    for (class_id, student_tg_id, quiz_id), s in scores.items():
+        row_of(class_id, student_tg_id)["cells"][quiz_id] = _quiz_cell(s)
+    for row in rows.values():
+        _tally(row)
+    return rows